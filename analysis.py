@@ -0,0 +1,113 @@
+"""
+Background analysis for the game window
+
+Analyzer searches positions in a separate process, so the pygame loop keeps
+drawing at full speed while the engine thinks. Every position sent with
+start is a new numbered request; it stops the search still running, and
+results of older requests are dropped when they arrive.
+
+    analyzer = Analyzer()
+    analyzer.start(board, max_time=3)
+    for final, depth, score, move in analyzer.poll():   # never blocks
+        ...
+"""
+
+import multiprocessing as mp
+import queue
+
+from board import Board
+from search import Search
+from tablebase import Tablebases
+from zobrist import TranspositionTable
+
+
+class AnalysisSearch(Search):
+    # Search that also stops once a newer request has been made
+    def __init__(self, board, tt, tablebases, number, current):
+        super().__init__(board, tt, tablebases)
+        self.number = number
+        self.current = current
+
+    def check_limits(self):
+        super().check_limits()
+        if self.current.value != self.number:
+            self.stopped = True
+
+
+def _analysis_worker(requests, results, current, tablebase_path, tt_megabytes):
+    # Runs in the analysis process: searches each request and posts
+    # (request number, final, depth, score, best move id) after every
+    # iteration, and once more when the search is over
+    tt = TranspositionTable(tt_megabytes)
+    tablebases = Tablebases(tablebase_path) if tablebase_path else None
+
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        number, position, keys, max_depth, max_time = request
+        if number != current.value:
+            continue
+
+        board = Board.from_history(position, keys)
+        search = AnalysisSearch(board, tt, tablebases, number, current)
+
+        depths = [0]
+
+        def info(depth, score, nodes, seconds, pv):
+            depths.append(depth)
+            results.put((number, False, depth, score, pv[0].move_id if pv else None))
+
+        move, score, pv = search.search(max_depth, max_time=max_time, info=info)
+        results.put((number, True, depths[-1], score, move.move_id if move is not None else None))
+
+
+class Analyzer:
+    # Runs searches in a worker process and collects their results
+    def __init__(self, tablebase_path=None, tt_megabytes=16):
+        self.requests = mp.Queue()
+        self.results = mp.Queue()
+        self.current = mp.Value('q', 0)
+        self.number = 0
+        self.moves = {}
+        self.running = False
+        self.process = mp.Process(target=_analysis_worker, daemon=True,
+                                  args=(self.requests, self.results, self.current, tablebase_path, tt_megabytes))
+        self.process.start()
+
+    def start(self, board, max_depth=64, max_time=None):
+        # Starts searching the board, stopping the search of any earlier request
+        self.number += 1
+        self.current.value = self.number
+        self.moves = board.get_valid_move_ids()
+        self.running = True
+        self.requests.put((self.number, board.encode(), board.encode_keys(), max_depth, max_time))
+
+    def cancel(self):
+        # Stops the running search, its results will be ignored
+        self.number += 1
+        self.current.value = self.number
+        self.running = False
+
+    def poll(self):
+        # Gets (final, depth, score, best move) for the results of the current
+        # request that have arrived, without waiting. final is True for the
+        # last one, once the search is over
+        updates = []
+        while True:
+            try:
+                number, final, depth, score, move_id = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if number == self.number:
+                updates.append((final, depth, score, self.moves.get(move_id)))
+                if final:
+                    self.running = False
+        return updates
+
+    def close(self):
+        self.cancel()
+        self.requests.put(None)
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
@@ -0,0 +1,217 @@
+"""
+Annotation of archived games: finds the inaccuracies, mistakes and blunders
+of each game with a fixed-depth search and writes the games back with
+comments
+
+Every position of a game is searched to the same depth. A move loses the
+difference between the score of the best move and the score of the move
+played, and moves that lose enough get a comment after them in the
+notation of Move.get_chess_notation:
+
+    12. c3d4 {Blunder (-3.10). Best: Nxd4 (+0.35), Bd2 (+0.10), Rd1 (-0.20)}
+
+Games are annotated on a pool of worker processes, with only a few games
+per worker queued at a time, and written to the output in their input
+order. After each game the number of games done and the output size are
+saved to a checkpoint file, so a run that is stopped carries on from there
+when it is started again with the same arguments.
+
+    python3 annotate.py games.pgn --output annotated.pgn --depth 3
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pgn import Game, read_games
+from profiling import enable_from_environment
+from search import Search, MATE, MATE_BOUND
+from zobrist import TranspositionTable, init_worker_table, worker_table
+
+# Centipawns a move must lose for each comment, largest first
+THRESHOLDS = ((300, "Blunder"), (100, "Mistake"), (50, "Inaccuracy"))
+
+# Alternatives listed for a blunder
+ALTERNATIVES = 3
+
+def format_score(score):
+    # Score in pawns, or #N for a mate in N moves (negative when being mated)
+    if abs(score) > MATE_BOUND:
+        moves = (MATE - abs(score) + 1) // 2
+        return "#%d" % moves if score > 0 else "#-%d" % moves
+    return "%+.2f" % (score / 100)
+
+
+def annotate(game, depth, tt=None):
+    # Gets a copy of the game with comments on the moves that lose at least
+    # the smallest threshold, and the number of (positions searched,
+    # comments of each kind). Raises ValueError for a move that cannot be made
+    tt = tt if tt is not None else TranspositionTable()
+    board = game.start_board()
+
+    # (move played, best move, score of the position for the side to move)
+    searched = []
+    for move in game.play(board):
+        best, score, _ = Search(board, tt).search(max_depth=depth)
+        searched.append((move, best, score))
+    _, final_score, _ = Search(board, tt).search(max_depth=depth)
+
+    comments = dict(game.comments)
+    counts = {name: 0 for _, name in THRESHOLDS}
+    scores = [score for _, _, score in searched] + [final_score]
+    for ply in range(len(searched) - 1, -1, -1):
+        move, best, score = searched[ply]
+        board.undo_move()
+        if best is None or move == best:
+            continue
+        # The score after the move is the next position's, seen from the other side
+        played = -scores[ply + 1]
+        loss = score - played
+        for threshold, name in THRESHOLDS:
+            if loss >= threshold:
+                break
+        else:
+            continue
+
+        if name == "Blunder":
+            # One more search of the position, with the table still holding
+            # the first one, for the scores of the best few moves
+            search = Search(board, tt)
+            search.reset()
+            better = ", ".join("%s (%s)" % (alternative.get_chess_notation(), format_score(alternative_score))
+                               for alternative_score, alternative in search.best_moves(depth, ALTERNATIVES))
+        else:
+            better = "%s (%s)" % (best.get_chess_notation(), format_score(score))
+        comments[ply] = "%s (%s). Best: %s" % (name, format_score(played), better)
+        counts[name] += 1
+
+    headers = dict(game.headers, Annotator="annotate.py depth %d" % depth)
+    return Game(headers, game.moves, game.result, comments), len(scores), counts
+
+
+def _annotate_task(task):
+    # Runs in a worker process: annotates one game, leaving games that
+    # cannot be replayed as they are
+    number, game, depth = task
+    try:
+        annotated, positions, counts = annotate(game, depth, worker_table())
+    except ValueError:
+        return number, game, 0, None
+    return number, annotated, positions, counts
+
+
+class Checkpoint:
+    # Games written so far and the output size after them, in a JSON file
+    # next to the output
+    def __init__(self, output):
+        self.path = output + ".checkpoint"
+        self.games = 0
+        self.size = 0
+        if os.path.exists(self.path):
+            with open(self.path) as file:
+                data = json.load(file)
+            self.games, self.size = data["games"], data["size"]
+
+    def save(self, games, size):
+        # Written to a new file and renamed, so a checkpoint is never half written
+        self.games, self.size = games, size
+        with open(self.path + ".tmp", "w") as file:
+            json.dump({"games": games, "size": size}, file)
+        os.replace(self.path + ".tmp", self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def annotate_archive(paths, output, depth=2, workers=None, tt_megabytes=16, progress=None):
+    # Annotates the games of the record files into the output file, resuming
+    # from its checkpoint if there is one. Returns (games, positions,
+    # comments of each kind, games that could not be replayed)
+    workers = workers or os.cpu_count() or 1
+    checkpoint = Checkpoint(output)
+    if not os.path.exists(checkpoint.path):
+        if os.path.exists(output):
+            raise ValueError(output + " exists and has no checkpoint")
+        checkpoint.save(0, 0)
+
+    # Drop anything written after the last checkpoint
+    with open(output, "ab") as file:
+        file.truncate(checkpoint.size)
+
+    def tasks():
+        number = 0
+        for path in paths:
+            for game in read_games(path):
+                if number >= checkpoint.games:
+                    yield number, game, depth
+                number += 1
+
+    games = positions = skipped = 0
+    counts = {name: 0 for _, name in THRESHOLDS}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker_table,
+                             initargs=(tt_megabytes,)) as pool, open(output, "a") as file:
+        pending = deque()
+        work = tasks()
+        while True:
+            while len(pending) < workers * 4:
+                task = next(work, None)
+                if task is None:
+                    break
+                pending.append(pool.submit(_annotate_task, task))
+            if not pending:
+                break
+
+            number, game, game_positions, game_counts = pending.popleft().result()
+            file.write(game.format())
+            file.flush()
+            checkpoint.save(number + 1, file.tell())
+
+            games += 1
+            positions += game_positions
+            if game_counts is None:
+                skipped += 1
+            else:
+                for name, count in game_counts.items():
+                    counts[name] += count
+            if progress is not None:
+                progress(games, positions)
+
+    checkpoint.remove()
+    return games, positions, counts, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotate the mistakes in game records")
+    parser.add_argument("paths", nargs="+", help="game record files (see pgn.py)")
+    parser.add_argument("--output", default="annotated.pgn")
+    parser.add_argument("--depth", type=int, default=2, help="search depth for every position")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--tt-size", type=int, default=16, help="transposition table per worker, in MB")
+    args = parser.parse_args()
+    enable_from_environment()
+
+    start = time.perf_counter()
+
+    def progress(games, positions):
+        if games % 100 == 0:
+            elapsed = time.perf_counter() - start
+            print("games %d  positions %d  games/s %.1f  positions/s %.0f" % (
+                games, positions, games / elapsed, positions / elapsed), flush=True)
+
+    try:
+        games, positions, counts, skipped = annotate_archive(args.paths, args.output, args.depth, args.workers,
+                                                             args.tt_size, progress)
+    except ValueError as error:
+        parser.error(str(error))
+    elapsed = time.perf_counter() - start
+    print("games %d  positions %d  skipped %d  time %.1fs  positions/s %.0f" % (
+        games, positions, skipped, elapsed, positions / elapsed if elapsed else 0))
+    print("  ".join("%s %d" % (name.lower(), count) for name, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Bitboard representation of the circular board
+
+Square (annulus, sector) is bit annulus*16 + sector of a 64-bit integer, so
+each annulus occupies its own 16-bit lane and wrapping around a ring is a
+rotation within that lane.
+"""
+
+from functools import lru_cache
+
+from constants import ANNULI, SECTORS
+
+SQUARES = ANNULI * SECTORS
+FULL = (1 << SQUARES) - 1
+
+PIECES = ['wp', 'wN', 'wB', 'wR', 'wQ', 'wK',
+          'bp', 'bN', 'bB', 'bR', 'bQ', 'bK']
+
+# Piece codes used by compact encodings, 0 is an empty square
+PIECE_CODES = {piece: code for code, piece in enumerate(PIECES, 1)}
+CODE_PIECES = ["--"] + PIECES
+
+# BIT[sq] is the single-bit bitboard of square sq
+BIT = [1 << sq for sq in range(SQUARES)]
+
+
+def square(a, sect):
+    # Index of the bit representing an (annulus, sector) square
+    return a * SECTORS + sect
+
+
+def sector_mask(sectors):
+    # Bitboard with every square of the given sectors set, on all annuli
+    mask = 0
+    for a in range(ANNULI):
+        for sect in sectors:
+            mask |= BIT[square(a, sect)]
+    return mask
+
+
+# Squares whose sector is >= n (HIGH) or < n (LOW), used to split a rotation
+# of every annulus by n sectors in the batch evaluation
+ROTATE_HIGH = [sector_mask(range(n, SECTORS)) for n in range(SECTORS)]
+ROTATE_LOW = [sector_mask(range(n)) for n in range(SECTORS)]
+
+
+def iter_squares(bb):
+    # Yields the square index of every set bit, lowest first
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def encode_board(board, white_to_move):
+    # Packs a 4x16 board into 65 bytes: a piece code per square, then the side to move
+    codes = [PIECE_CODES.get(piece, 0) for row in board for piece in row]
+    codes.append(1 if white_to_move else 0)
+    return bytes(codes)
+
+
+def decode_board(data):
+    # Unpacks encode_board, returns (4x16 board, white_to_move)
+    board = [[CODE_PIECES[code] for code in data[a * SECTORS:(a + 1) * SECTORS]] for a in range(ANNULI)]
+    return board, bool(data[SQUARES])
+
+
+@lru_cache(maxsize=65536)
+def row_bitboards(a, row):
+    # Gets (piece, bitboard) pairs for the pieces of one annulus. Boards
+    # built in bulk share most of their rows, so the result is cached
+    bitboards = {}
+    for sect, piece in enumerate(row):
+        if piece != "--":
+            bitboards[piece] = bitboards.get(piece, 0) | BIT[square(a, sect)]
+    return tuple(bitboards.items())
+
+
+class Position:
+    # Bitboard-backed position: one 64-bit integer per piece type and color,
+    # plus the 4x16 list of piece strings used to look up what is on a square
+    def __init__(self, board):
+        self.board = board
+
+        self.pieces = {piece: 0 for piece in PIECES}
+        self.colors = {'w': 0, 'b': 0}
+
+        for a in range(ANNULI):
+            for piece, bits in row_bitboards(a, tuple(board[a])):
+                self.pieces[piece] |= bits
+                self.colors[piece[0]] |= bits
+
+    @property
+    def occupied(self):
+        return self.colors['w'] | self.colors['b']
+
+    def make_move(self, move):
+        # Moves a piece on both the bitboards and the mailbox. A promoting
+        # pawn leaves the start square and the new piece lands on the end one
+        start = BIT[move.start_sq]
+        end = BIT[move.end_sq]
+
+        piece = move.piece_moved
+        placed = move.promotion or piece
+        self.pieces[piece] ^= start
+        self.pieces[placed] ^= end
+        self.colors[piece[0]] ^= start | end
+
+        captured = move.piece_captured
+        if captured != "--":
+            self.pieces[captured] ^= end
+            self.colors[captured[0]] ^= end
+
+        self.board[move.start_ann][move.start_sect] = "--"
+        self.board[move.end_ann][move.end_sect] = placed
+
+    def undo_move(self, move):
+        # Reverses make_move for the same move
+        start = BIT[move.start_sq]
+        end = BIT[move.end_sq]
+
+        piece = move.piece_moved
+        self.pieces[piece] ^= start
+        self.pieces[move.promotion or piece] ^= end
+        self.colors[piece[0]] ^= start | end
+
+        captured = move.piece_captured
+        if captured != "--":
+            self.pieces[captured] ^= end
+            self.colors[captured[0]] ^= end
+
+        self.board[move.start_ann][move.start_sect] = piece
+        self.board[move.end_ann][move.end_sect] = captured
@@ -1,461 +1,534 @@
-import numpy as np
-import pygame as pg
-import pygame.gfxdraw
+from array import array
+from functools import lru_cache
+
 from constants import *
+from bitboard import FULL, BIT, Position, square, iter_squares, encode_board, decode_board
+from zobrist import PIECE_KEYS, SIDE_KEY, compute_key
+from tables import (COORDS, KING_MASKS, KNIGHT_MASKS, ROOK_RAYS, BISHOP_RAYS, QUEEN_RAYS,
+                    PAWN_PUSHES, PAWN_ATTACK_MASKS, PAWN_ATTACKER_MASKS)
+
+
+# Starting position: kings and queens on the inner ring, rooks on the outer ring
+START_BOARD = [
+    ["--", "--", "bp", "bQ", "bK", "bp", "--", "--",
+     "--", "--", "wp", "wK", "wQ", "wp", "--", "--"],
+    ["--", "--", "bp", "bB", "bB", "bp", "--", "--",
+     "--", "--", "wp", "wB", "wB", "wp", "--", "--"],
+    ["--", "--", "bp", "bN", "bN", "bp", "--", "--",
+     "--", "--", "wp", "wN", "wN", "wp", "--", "--"],
+    ["--", "--", "bp", "bR", "bR", "bp", "--", "--",
+     "--", "--", "wp", "wR", "wR", "wp", "--", "--"]
+]
+
+# Letters used for the pieces in FEN strings, uppercase for white
+PIECE_FEN = {'wp': 'P', 'wN': 'N', 'wB': 'B', 'wR': 'R', 'wQ': 'Q', 'wK': 'K',
+             'bp': 'p', 'bN': 'n', 'bB': 'b', 'bR': 'r', 'bQ': 'q', 'bK': 'k'}
+FEN_PIECES = {v: k for k, v in PIECE_FEN.items()}
+
+# Pieces a pawn can promote to, in the order the moves are generated
+PROMOTION_PIECES = "QRBN"
+
+# Sectors of the files a to p, in the order FEN strings list them
+FILE_SECTORS = [11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1, 0, 15, 14, 13, 12]
+
+START_FEN = "RP4prrp4PR/NP4pnnp4PN/BP4pbbp4PB/KP4pkqp4PQ w 0 1"
+
+
+def parse_fen(fen):
+    # Parses a FEN-like string: the ranks from 4 (outer ring) down to 1, each
+    # listing files a to p with uppercase white and lowercase black pieces and
+    # digits for runs of empty squares, then the side to move and optionally
+    # the halfmove clock and fullmove number, e.g. START_FEN.
+    # Returns (4x16 rows, white_to_move, halfmove_clock, fullmove_number),
+    # the arguments of Board(), without building the board itself
+    fields = fen.split()
+    if len(fields) not in (2, 4) or fields[1] not in ('w', 'b'):
+        raise ValueError("Invalid FEN: " + fen)
+    ranks = fields[0].split('/')
+    if len(ranks) != ANNULI:
+        raise ValueError("Invalid FEN: " + fen)
+
+    # Ranks are listed outermost first
+    rows = [parse_fen_rank(rank) for rank in reversed(ranks)]
+
+    if len(fields) == 4:
+        if not fields[2].isdigit() or not fields[3].isdigit():
+            raise ValueError("Invalid FEN: " + fen)
+        return rows, fields[1] == 'w', int(fields[2]), int(fields[3])
+    return rows, fields[1] == 'w', 0, 1
+
+
+# Positions loaded in bulk share most of their ranks, so parsed and
+# formatted ranks are cached
+@lru_cache(maxsize=65536)
+def parse_fen_rank(rank):
+    # Gets the 16 pieces, in sector order, of one FEN rank. Runs of empty
+    # squares are 1 to 16, without leading zeros, and the rank has to cover
+    # exactly 16 sectors. Invalid ranks raise ValueError and are not cached
+    row = ["--"] * SECTORS
+    file = 0
+    empty = ''
+    for char in rank + ' ':
+        if char.isdigit():
+            empty += char
+            continue
+        if empty:
+            if empty[0] == '0' or file + int(empty) > SECTORS:
+                raise ValueError("Invalid FEN rank: " + rank)
+            file += int(empty)
+            empty = ''
+        if char == ' ':
+            break
+        if char not in FEN_PIECES or file >= SECTORS:
+            raise ValueError("Invalid FEN rank: " + rank)
+        row[FILE_SECTORS[file]] = FEN_PIECES[char]
+        file += 1
+    if file != SECTORS:
+        raise ValueError("Invalid FEN rank: " + rank)
+    return tuple(row)
+
+
+@lru_cache(maxsize=65536)
+def format_fen_rank(row):
+    # Gets the FEN rank of a row of 16 pieces in sector order
+    rank = ''
+    empty = 0
+    for sect in FILE_SECTORS:
+        piece = row[sect]
+        if piece == "--":
+            empty += 1
+            continue
+        if empty:
+            rank += str(empty)
+            empty = 0
+        rank += PIECE_FEN[piece]
+    if empty:
+        rank += str(empty)
+    return rank
+
+
+def read_fens(path, boards=True):
+    # Yields a board for every non-empty line of a file of FEN strings, or
+    # just the parse_fen result when boards is False
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield Board(*parse_fen(line)) if boards else parse_fen(line)
 
 
 class Board:
-    def __init__(self):
+    def __init__(self, board=None, white_to_move=True, halfmove_clock=0, fullmove_number=1):
         # Board is a 4x16 2D list, each entry has 2 characters:
         # first character represents color: 'b' or 'w'
         # second character represents type of piece: 'K', 'Q', 'R', 'B', 'N', 'p'
         # "--" represents an empty square
-        self.board = [
-            ["--", "--", "bp", "bQ", "bK", "bp", "--", "--",
-             "--", "--", "wp", "wK", "wQ", "wp", "--", "--"],
-            ["--", "--", "bp", "bB", "bB", "bp", "--", "--",
-             "--", "--", "wp", "wB", "wB", "wp", "--", "--"],
-            ["--", "--", "bp", "bN", "bN", "bp", "--", "--",
-             "--", "--", "wp", "wN", "wN", "wp", "--", "--"],
-            ["--", "--", "bp", "bR", "bR", "bp", "--", "--",
-             "--", "--", "wp", "wR", "wR", "wp", "--", "--"]
-        ]
-        self.move_functions = {'p': self.get_pawn_moves2,
-                               'R': self.get_rook_moves,
+        # Without a board the game starts from the standard position
+        if board is None:
+            board = START_BOARD
+        board = [list(row) for row in board]
+
+        # The position keeps a bitboard per piece alongside the 2D list, which
+        # stays available as self.board for drawing and building moves
+        self.position = Position(board)
+        self.board = self.position.board
+
+        self.move_functions = {'R': self.get_rook_moves,
                                'B': self.get_bishop_moves,
                                'N': self.get_knight_moves,
                                'Q': self.get_queen_moves,
                                'K': self.get_king_moves}
 
-        self.white_to_move = True
+        self.white_to_move = white_to_move
 
         self.move_log = []
 
-    def fill_arc(self, window, center, radius, theta0, theta1, color, ndiv=150):
-        # Fills an arc in the window to represent a circular sector
-        x0, y0 = center
-
-        dtheta = (theta1 - theta0) / ndiv
-        angles = [theta0 + i*dtheta for i in range(ndiv + 1)]
-
-        points = [(x0, y0)] + [(x0 + radius * np.cos(theta), y0 -
-                                radius * np.sin(theta)) for theta in angles]
-
-        pygame.gfxdraw.filled_polygon(window, points, color)
-
-    def draw_board(self, window):
-        # Draws the circular chess board
-        for ring in range(ANNULI):
-            radius = WIDTH//2 - ring*SPACING
-            for sector in range(SECTORS):
-                color = DARK if ((sector+ring) % 2) else LIGHT
-
-                self.fill_arc(window, CENTER, radius, sector *
-                              SLICE, (sector+1)*SLICE, color)
-
-        pg.draw.circle(window, GRAY, CENTER, MIDDLE_RADIUS)
-
-    def draw_pieces(self, window, images):
-        # Draws the chess pieces on the circular chess board
-
-        # Get the center coordinates of the circular chess board
-        x0, y0 = CENTER
-        # Starting angle for the first sector
-        theta0 = SLICE / 2
-        # Initial radius of the circular board
-        r0 = MIDDLE_RADIUS
-
-        # Iterate over the annuli (circles) on the chess board
-        for a in range(ANNULI):
-            # Calculate the current radius, accounting for spacing and scaling
-            r = r0 + (SPACING * a)
-            r *= SCALING
-
-            # Iterate over the sectors in each annulus
-            for sect in range(SECTORS):
-                # Get the chess piece at the current annulus and sector
-                piece = self.board[a][sect]
-
-                # Check if the square is not empty
-                if piece != "--":
-                    # Calculate the angle based on the sector
-                    theta = theta0 + (SLICE * sect)
-
-                    # Calculate the coordinates for placing the piece on the board
-                    if sect >= 0 and sect < 4:
-                        # top left
-                        x = x0 + ((r * np.cos(pi - theta))) - (PIECE_SIZE/2)
-                        y = y0 - ((r * np.sin(pi - theta))) - (PIECE_SIZE/2)
-                    elif sect >= 4 and sect < 8:
-                        # top right
-                        x = x0 - (r * np.cos(theta)) - (PIECE_SIZE/2)
-                        y = y0 - (r * np.sin(theta)) - (PIECE_SIZE/2)
-                    elif sect >= 8 and sect < 12:
-                        # bottom right
-                        x = x0 + (r * np.cos(pi - theta)) - (PIECE_SIZE/2)
-                        y = y0 - (r * np.sin(pi - theta)) - (PIECE_SIZE/2)
-                    elif sect >= 12 and sect < 16:
-                        # bottom left
-                        x = x0 + (r * np.cos(pi - theta)) - (PIECE_SIZE/2)
-                        y = y0 - (r * np.sin(pi - theta)) - (PIECE_SIZE/2)
-
-                    # Blit the chess piece image onto the window at the calculated coordinates
-                    window.blit(images[piece], pg.Rect(
-                        x, y, PIECE_SIZE, PIECE_SIZE))
-
-    def draw(self, window, images):
-        # Combines the board and piece drawing
-        self.draw_board(window)
-        self.draw_pieces(window, images)
+        # Plies since the last capture or pawn move for every position of the
+        # game, and the number of the current move, counted from 1 and
+        # increased after each black move
+        self.halfmove_log = [halfmove_clock]
+        self.fullmove_number = fullmove_number
+
+        # Zobrist key of every position of the game, the last one is the
+        # current position. make_move updates it incrementally
+        self.key_log = [compute_key(self.board, self.white_to_move)]
+
+        # Checkers and pinned pieces of the side to move for every position of
+        # the game, worked out the first time they are needed
+        self.check_log = [None]
+        self.checkmate = False
+        self.stalemate = False
+
+        # Created by get_renderer when the board is first drawn
+        self.renderer = None
+
+    @classmethod
+    def from_encoding(cls, data):
+        # Creates a board from the bytes returned by encode
+        board, white_to_move = decode_board(data)
+        return cls(board, white_to_move)
+
+    @classmethod
+    def from_history(cls, data, keys):
+        # Creates a board from the bytes returned by encode and encode_keys,
+        # so positions from before it still count as repetitions. The keys
+        # go back to the last capture or pawn move, which sets the halfmove clock
+        board = cls.from_encoding(data)
+        board.key_log = list(array('Q', keys))
+        board.halfmove_log = [len(board.key_log) - 1]
+        return board
+
+    def encode(self):
+        # Compact encoding of the position, one byte per square plus the side
+        # to move, for sending positions to other processes
+        return encode_board(self.board, self.white_to_move)
+
+    def encode_keys(self):
+        # The Zobrist keys of the positions since the last capture or pawn
+        # move, the only ones the position can repeat, as bytes for from_history
+        return array('Q', self.key_log[-self.halfmove_clock - 1:]).tobytes()
+
+    @classmethod
+    def from_fen(cls, fen):
+        # Creates a board from a FEN-like string, see parse_fen. Building the
+        # bitboards and Zobrist key costs about four times the parsing
+        # (roughly 55k against 260k positions/s of distinct positions), so
+        # bulk loaders that only need the squares should use parse_fen
+        return cls(*parse_fen(fen))
+
+    def to_fen(self):
+        # Gets the FEN-like string of the position, see from_fen
+        ranks = '/'.join(format_fen_rank(tuple(self.board[a])) for a in reversed(range(ANNULI)))
+        return "%s %s %d %d" % (ranks, 'w' if self.white_to_move else 'b',
+                                self.halfmove_clock, self.fullmove_number)
+
+    def get_renderer(self):
+        # Drawing lives in render.py, which is only imported (along with
+        # pygame and numpy) the first time the board is drawn
+        if self.renderer is None:
+            from render import BoardRenderer
+            self.renderer = BoardRenderer()
+        return self.renderer
+
+    def set_theme(self, light, dark):
+        # Changes the square colors, the board is redrawn on the next frame
+        self.get_renderer().theme = (light, dark)
+
+    def draw(self, window, images, highlights=(), hints=()):
+        # Draws the board and pieces, circling the highlighted and hint squares
+        self.get_renderer().draw(window, self.board, images, highlights, hints)
+
+    def draw_squares(self, window, images, squares, highlights=(), hints=()):
+        # Redraws only the given (annulus, sector) squares and returns the
+        # rectangles that changed, for pg.display.update
+        return self.get_renderer().draw_squares(window, self.board, images, squares, highlights, hints)
 
     def make_move(self, move):
         # Makes a move on the board and updates the game state
-        self.board[move.start_ann][move.start_sect] = "--"
-        self.board[move.end_ann][move.end_sect] = move.piece_moved
+        self.position.make_move(move)
         self.move_log.append(move)
+        self.check_log.append(None)
+
+        key = (self.key_log[-1] ^ SIDE_KEY ^ PIECE_KEYS[move.piece_moved][move.start_sq] ^
+               PIECE_KEYS[move.promotion or move.piece_moved][move.end_sq])
+        if move.piece_captured != "--":
+            key ^= PIECE_KEYS[move.piece_captured][move.end_sq]
+        self.key_log.append(key)
+
+        if move.piece_moved[1] == 'p' or move.piece_captured != "--":
+            self.halfmove_log.append(0)
+        else:
+            self.halfmove_log.append(self.halfmove_log[-1] + 1)
+        if not self.white_to_move:
+            self.fullmove_number += 1
         self.white_to_move = not self.white_to_move
 
     def undo_move(self):
         # Undoes the last move made
         if len(self.move_log) != 0:
             move = self.move_log.pop()
-            self.board[move.start_ann][move.start_sect] = move.piece_moved
-            self.board[move.end_ann][move.end_sect] = move.piece_captured
+            self.position.undo_move(move)
+            self.check_log.pop()
+            self.key_log.pop()
+            self.halfmove_log.pop()
+            if self.white_to_move:
+                self.fullmove_number -= 1
             self.white_to_move = not self.white_to_move
 
-    def get_valid_moves(self):
-        return self.get_all_moves()
-
-    def get_all_moves(self):
-        # Gets all valid moves for the current player
-        moves = []
-        for a in range(ANNULI):
-            for sect in range(SECTORS):
-                turn = self.board[a][sect][0]
-                if (turn == 'w' and self.white_to_move) or \
-                        (turn == 'b' and not self.white_to_move):
-                    piece = self.board[a][sect][1]
-                    # Calls appropriate move function based on piece type
-                    self.move_functions[piece](a, sect, moves)
-
-        return moves
-    
-    def get_pawn_moves2(self, a, sect, moves):
-        
-        on_left_half = sect > 12 or sect < 3
-        on_right_half = sect > 4 and sect < 11
-        enemy_color = 'b' if self.white_to_move else 'w'
-        next_sect = sect
-
-        if on_right_half:
-            
-            direction = -1 if self.white_to_move else 1
-            start_space = 10 if self.white_to_move else 5
-        
-        elif on_left_half:
-            
-            direction = 1 if self.white_to_move else -1
-            start_space = 13 if self.white_to_move else 2
-            
-            if sect + direction == 16:
-                next_sect = -1
-            elif sect + direction == -1:
-                next_sect = 16
-        
-        next_sect += direction
-        
-        # 1-space pawn move
-        if self.board[a][next_sect] == "--":
-            moves.append(Move((a, sect), (a, next_sect), self.board))
-            # 2-space pawn move
-            if sect == start_space and self.board[a][next_sect + direction] == "--":
-                moves.append(Move((a, sect), (a, next_sect + direction), self.board))
-                
-        # captures
-        if a - 1 >= 0:
-            if self.board[a - 1][next_sect][0] == enemy_color:
-                moves.append(Move((a, sect), (a - 1, next_sect), self.board))
-        if a + 1 < 4:
-            if self.board[a + 1][next_sect][0] == enemy_color:
-                print(f"a: {a} , a+1: {a+1}, sect: {sect}, sect+direction: {sect+direction}")
-                moves.append(Move((a, sect), (a + 1, next_sect), self.board))
-            
-            
-            
-    def get_pawn_moves(self, a, sect, moves):
-        # Determine the board region where the pawn is located
-        on_right_half = sect > 4 and sect < 11
-        on_left_half_w = (sect > 12 and sect < 15) or (sect >= 0 and sect < 3)
-        on_left_half_b = (sect > 12 and sect <= 15) or (sect > 0 and sect < 3)
-        
-
-        if self.white_to_move:
-            # White's turn
-
-            # One-square pawn move
-            if on_right_half:
-                if self.board[a][sect - 1] == "--":
-                    moves.append(Move((a, sect), (a, sect - 1), self.board))
-                    # Two-square pawn move
-                    if sect == 10 and self.board[a][sect - 2] == "--":
-                        moves.append(
-                            Move((a, sect), (a, sect - 2), self.board))
-            elif on_left_half_w:
-                if self.board[a][sect + 1] == "--":
-                    moves.append(Move((a, sect), (a, sect + 1), self.board))
-                    # Two-square pawn move
-                    if sect == 13 and self.board[a][sect + 2] == "--":
-                        moves.append(
-                            Move((a, sect), (a, sect + 2), self.board))
-            elif sect == 15 and self.board[a][0] == "--":
-                moves.append(Move((a, sect), (a, 0), self.board))
-
-            # Pawn captures
-            if a - 1 >= 0:
-                if on_right_half:
-                    if self.board[a - 1][sect - 1][0] == 'b':
-                        moves.append(
-                            Move((a, sect), (a - 1, sect - 1), self.board))
-                elif on_left_half_w:
-                    if self.board[a - 1][sect + 1][0] == 'b':
-                        moves.append(
-                            Move((a, sect), (a - 1, sect + 1), self.board))
-                elif sect == 15 and self.board[a - 1][0][0] == 'b':
-                    moves.append((Move((a, sect), (a - 1, 0), self.board)))
-
-            if a + 1 < 4:
-                if on_right_half:
-                    if self.board[a + 1][sect - 1][0] == 'b':
-                        moves.append(
-                            Move((a, sect), (a + 1, sect - 1), self.board))
-                elif on_left_half_w:
-                    if self.board[a + 1][sect + 1][0] == 'b':
-                        moves.append(
-                            Move((a, sect), (a + 1, sect + 1), self.board))
-                elif sect == 15 and self.board[a + 1][0][0] == 'b':
-                    moves.append((Move((a, sect), (a + 1, 0), self.board)))
+    @property
+    def halfmove_clock(self):
+        return self.halfmove_log[-1]
 
-        else:
-            # Black's turn
-
-            # One-square pawn move
-            if on_right_half:
-                if self.board[a][sect + 1] == "--":
-                    moves.append(Move((a, sect), (a, sect + 1), self.board))
-                    # Two-square pawn move
-                    if sect == 5 and self.board[a][sect + 2] == "--":
-                        moves.append(
-                            Move((a, sect), (a, sect + 2), self.board))
-            elif on_left_half_b:
-                if self.board[a][sect - 1] == "--":
-                    moves.append(Move((a, sect), (a, sect - 1), self.board))
-                    # Two-square pawn move
-                    if sect == 2 and self.board[a][sect - 2] == "--":
-                        moves.append(
-                            Move((a, sect), (a, sect - 2), self.board))
-            elif sect == 0 and self.board[a][15] == "--":
-                moves.append(Move((a, sect), (a, 15), self.board))
-
-            # Pawn captures
-            if a - 1 >= 0:
-                if on_right_half:
-                    if self.board[a - 1][sect + 1][0] == 'w':
-                        moves.append(
-                            Move((a, sect), (a - 1, sect + 1), self.board))
-                elif on_left_half_b:
-                    if self.board[a - 1][sect - 1][0] == 'w':
-                        moves.append(
-                            Move((a, sect), (a - 1, sect - 1), self.board))
-                elif sect == 0 and self.board[a - 1][15][0] == 'w':
-                    moves.append((Move((a, sect), (a - 1, 15), self.board)))
-
-            if a + 1 < 4:
-                if on_right_half:
-                    if self.board[a + 1][sect + 1][0] == 'w':
-                        moves.append(
-                            Move((a, sect), (a + 1, sect + 1), self.board))
-                elif on_left_half_b:
-                    if self.board[a + 1][sect - 1][0] == 'w':
-                        moves.append(
-                            Move((a, sect), (a + 1, sect - 1), self.board))
-                elif sect == 0 and self.board[a + 1][15][0] == 'w':
-                    moves.append((Move((a, sect), (a + 1, 15), self.board)))
+    @property
+    def zobrist_key(self):
+        # 64-bit key of the current position, including the side to move
+        return self.key_log[-1]
 
-    def get_rook_moves(self, a, sect, moves):
-        # Determine the color of the enemy based on the current player's turn
-        enemy_color = 'b' if self.white_to_move else 'w'
+    def repetition_count(self):
+        # How many times the current position has occurred in this game
+        return self.key_log.count(self.key_log[-1])
 
-        # Define possible movement directions for a rook
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-
-        def is_valid_space(ann, sec):
-            # Check if the given coordinates are within the valid chess board range
-            return (sec >= 0 and sec < 16) and (ann >= 0 and ann < 4)
-
-        def check(direction, ann, sec):
-            # Helper function to check and add moves in a given direction
-
-            # Calculate the new coordinates based on the movement direction
-            new_a = ann + direction[0]
-            new_sect = sec + direction[1]
-
-            # Handle wrap-around if the new sector goes beyond the board limits
-            if new_sect == -1:
-                new_sect = 15
-            elif new_sect == 16:
-                new_sect = 0
-
-            # Check if the new coordinates are within the valid chess board range
-            if not is_valid_space(new_a, new_sect):
-                return
-
-            # If the target space is empty, add a regular move and recursively check further
-            if self.board[new_a][new_sect] == "--":
-                moves.append(Move((a, sect), (new_a, new_sect), self.board))
-                check(direction, new_a, new_sect)
-                return
-            # If the target space has an enemy piece, add a capturing move and stop
-            elif self.board[new_a][new_sect][0] == enemy_color:
-                moves.append(Move((a, sect), (new_a, new_sect), self.board))
-                return
-            else:
-                # If the target space has a friendly piece, stop searching in this direction
-                return
-
-        # Iterate over all possible movement directions for a rook
-        for d in directions:
-            # Check and add moves in the specified direction
-            check(d, a, sect)
+    def is_repetition(self):
+        # Whether the current position occurred before. Only positions since
+        # the last capture or pawn move with the same side to move can match,
+        # so every other key back to there is checked
+        return self.key_log[-1] in self.key_log[-3:-self.halfmove_log[-1] - 2:-2]
 
-    def get_bishop_moves(self, a, sect, moves):
-        # Determine the color of the enemy based on the current player's turn
+    def get_valid_moves(self):
+        # Gets the legal moves for the current player, the moves from
+        # get_all_moves that do not leave their own king in check
+        checkers, evasions, pins = self.get_check_info()
+        color = 'w' if self.white_to_move else 'b'
         enemy_color = 'b' if self.white_to_move else 'w'
+        # Sliders see through the king's current square when it steps away
+        occupied = self.position.occupied & ~self.position.pieces[color + 'K']
 
-        # Define possible movement directions for a bishop
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-
-        def is_valid_space(ann, sec):
-            # Check if the given coordinates are within the valid chess board range
-            return (sec >= 0 and sec < 16) and (ann >= 0 and ann < 4)
-
-        def check(direction, ann, sec):
-            # Helper function to check and add moves in a given diagonal direction
-
-            # Calculate the new coordinates based on the movement direction
-            new_a = ann + direction[0]
-            new_sect = sec + direction[1]
-
-            # Handle wrap-around if the new sector goes beyond the board limits
-            if new_sect == -1:
-                new_sect = 15
-            elif new_sect == 16:
-                new_sect = 0
-
-            # Check if the new coordinates are within the valid chess board range
-            if not is_valid_space(new_a, new_sect):
-                return
-
-            # If the target space is empty, add a regular move and recursively check further
-            if self.board[new_a][new_sect] == "--":
-                moves.append(Move((a, sect), (new_a, new_sect), self.board))
-                check(direction, new_a, new_sect)
-                return
-            # If the target space has an enemy piece, add a capturing move and stop
-            elif self.board[new_a][new_sect][0] == enemy_color:
-                moves.append(Move((a, sect), (new_a, new_sect), self.board))
-                return
-            else:
-                # If the target space has a friendly piece, stop searching in this direction
-                return
-
-        # Iterate over all possible diagonal movement directions for a bishop
-        for d in directions:
-            # Check and add moves in the specified diagonal direction
-            check(d, a, sect)
+        moves = []
+        for move in self.get_all_moves():
+            end = move.end_sq
+            if move.piece_moved[1] == 'K':
+                if not self.is_attacked(end, enemy_color, occupied):
+                    moves.append(move)
+                continue
+
+            # Other pieces have to answer a check and may only move along a pin
+            if not BIT[end] & evasions:
+                continue
+            pin = pins.get(move.start_sq)
+            if pin is not None and not BIT[end] & pin:
+                continue
+            moves.append(move)
+
+        self.checkmate = not moves and bool(checkers)
+        self.stalemate = not moves and not checkers
+        return moves
 
-    def get_queen_moves(self, a, sect, moves):
-        # Combine the moves of a bishop and a rook to get queen moves
-        self.get_bishop_moves(a, sect, moves)
-        self.get_rook_moves(a, sect, moves)
+    def get_valid_move_ids(self):
+        # Gets the valid moves as a dict keyed by Move.move_id, for O(1) lookups
+        return {move.move_id: move for move in self.get_valid_moves()}
+
+    def parse_move(self, notation, legal=True):
+        # Finds the valid move written in long notation (see Move.get_long_notation),
+        # or any move from get_all_moves when legal is False
+        try:
+            start = (Move.rank_to_ann[notation[1]], Move.file_to_sect[notation[0]])
+            end = (Move.rank_to_ann[notation[3]], Move.file_to_sect[notation[2]])
+            promotion = notation[4].upper() if len(notation) == 5 else None
+            if len(notation) not in (4, 5) or (promotion and promotion not in PROMOTION_PIECES):
+                raise KeyError(notation)
+        except (KeyError, IndexError):
+            raise ValueError("Not a move: " + notation)
+
+        # Replaying games only needs the moves of the piece being moved
+        moves = self.get_valid_moves() if legal else self.get_square_moves(*start)
+        move_id = Move.encode(square(*start), square(*end), promotion)
+        for move in moves:
+            if move.move_id == move_id:
+                return move
+        raise ValueError("Not a valid move: " + notation)
+
+    def get_square_moves(self, a, sect):
+        # Gets the moves from get_all_moves of the piece on one square
+        piece = self.board[a][sect]
+        moves = []
+        if piece == "--" or (piece[0] == 'w') != self.white_to_move:
+            return moves
+        if piece[1] == 'p':
+            self.get_pawn_moves(moves, BIT[square(a, sect)])
+            return moves
+        self.move_functions[piece[1]](a, sect, moves)
+        return moves
 
-    def get_king_moves(self, a, sect, moves):
-        # Determine the opponent's color based on the current player's turn
+    def in_check(self):
+        # Whether the king of the current player is attacked
+        return bool(self.get_check_info()[0])
+
+    def get_check_info(self):
+        # Gets (checkers, evasions, pins) for the current position, see find_checks_and_pins
+        info = self.check_log[-1]
+        if info is None:
+            info = self.check_log[-1] = self.find_checks_and_pins()
+        return info
+
+    def find_checks_and_pins(self):
+        # Looks outwards from the king of the current player for enemy pieces
+        # giving check and friendly pieces pinned against it. Returns the
+        # checkers bitboard, the squares a non-king move must land on to
+        # capture or block every checker (all squares when not in check), and a
+        # dict from each pinned square to the squares it may still move to
+        color = 'w' if self.white_to_move else 'b'
         enemy_color = 'b' if self.white_to_move else 'w'
+        pieces = self.position.pieces
+        own = self.position.colors[color]
+        enemy = self.position.colors[enemy_color]
+
+        king = pieces[color + 'K']
+        if not king:
+            # The king has been snaffled, there is nothing left to protect
+            return 0, FULL, {}
+        k = king.bit_length() - 1
+
+        checkers = (KNIGHT_MASKS[k] & pieces[enemy_color + 'N']) | \
+            (KING_MASKS[k] & pieces[enemy_color + 'K']) | \
+            (PAWN_ATTACKER_MASKS[enemy_color][k] & pieces[enemy_color + 'p'])
+        evasions = FULL
+        for sq in iter_squares(checkers):
+            evasions &= BIT[sq]
+
+        pins = {}
+        queens = pieces[enemy_color + 'Q']
+        for rays, sliders in ((ROOK_RAYS[k], pieces[enemy_color + 'R'] | queens),
+                              (BISHOP_RAYS[k], pieces[enemy_color + 'B'] | queens)):
+            for ray in rays:
+                path = 0
+                pinned = None
+                for sq in ray:
+                    bit = BIT[sq]
+                    path |= bit
+                    if own & bit:
+                        if pinned is not None:
+                            break
+                        pinned = sq
+                    elif enemy & bit:
+                        if sliders & bit:
+                            if pinned is None:
+                                # A rook or queen can check along both ways
+                                # around a ring, so evasions are intersected
+                                checkers |= bit
+                                evasions &= path
+                            else:
+                                pins[pinned] = pins.get(pinned, FULL) & path
+                        break
+
+        return checkers, evasions, pins
+
+    def is_attacked(self, sq, color, occupied):
+        # Whether any piece of the given color attacks the square, with sliders
+        # blocked by the occupied bitboard
+        pieces = self.position.pieces
+        if (KNIGHT_MASKS[sq] & pieces[color + 'N']) or (KING_MASKS[sq] & pieces[color + 'K']) or \
+                (PAWN_ATTACKER_MASKS[color][sq] & pieces[color + 'p']):
+            return True
+
+        queens = pieces[color + 'Q']
+        for rays, sliders in ((ROOK_RAYS[sq], pieces[color + 'R'] | queens),
+                              (BISHOP_RAYS[sq], pieces[color + 'B'] | queens)):
+            for ray in rays:
+                for t in ray:
+                    bit = BIT[t]
+                    if occupied & bit:
+                        if sliders & bit:
+                            return True
+                        break
+        return False
 
-        # Define possible directions for king movement
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1),
-                      (1, 0), (0, 1), (-1, 0), (0, -1)]
-
-        def is_valid_space(ann, sec):
-            # Helper function to check if a space is within the board boundaries
-            return (sec >= 0 and sec < 16) and (ann >= 0 and ann < 4)
-
-        def check(direction, ann, sec):
-            # Helper function to check and add valid king moves in a given direction
-            new_a = ann + direction[0]
-            new_sect = sec + direction[1]
-            if new_sect == -1:
-                new_sect = 15
-            elif new_sect == 16:
-                new_sect = 0
-            if not is_valid_space(new_a, new_sect):
-                return
-
-            if self.board[new_a][new_sect] == "--":
-                # Empty space, valid king move
-                moves.append(Move((a, sect), (new_a, new_sect), self.board))
-            elif self.board[new_a][new_sect][0] == enemy_color:
-                # Capturing opponent's piece, valid king move
-                moves.append(Move((a, sect), (new_a, new_sect), self.board))
-
-        # Check moves in all directions
-        for d in directions:
-            check(d, a, sect)
+    def get_all_moves(self):
+        # Gets all valid moves for the current player
+        moves = []
+        color = 'w' if self.white_to_move else 'b'
 
-    def get_knight_moves(self, a, sect, moves):
-        # Determine the opponent's color based on the current player's turn
-        enemy_color = 'b' if self.white_to_move else 'w'
+        # Pawns are generated all at once, the other pieces square by square
+        self.get_pawn_moves(moves)
 
-        # Define possible knight move directions
-        directions = [(2, 1), (2, -1), (-2, 1), (-2, -1),
-                      (1, 2), (1, -2), (-1, 2), (-1, -2)]
+        pieces = self.position.colors[color] & ~self.position.pieces[color + 'p']
+        while pieces:
+            low = pieces & -pieces
+            a, sect = divmod(low.bit_length() - 1, SECTORS)
+            # Calls appropriate move function based on piece type
+            self.move_functions[self.board[a][sect][1]](a, sect, moves)
+            pieces ^= low
 
-        def is_valid_space(ann, sec):
-            # Helper function to check if a space is within the board boundaries
-            return (sec >= 0 and sec < 16) and (ann >= 0 and ann < 4)
+        return moves
 
-        def check(direction, ann, sec):
-            # Helper function to check and add valid knight moves in a given direction
-            new_a = ann + direction[0]
-            new_sect = sec + direction[1]
+    def get_pawn_moves(self, moves, pawns=None):
+        # Generates the moves of the current player's pawns (all of them, or
+        # those in the pawns bitboard) from the precomputed push and capture
+        # tables. Moves onto a promotion square are added once per piece
+        color = 'w' if self.white_to_move else 'b'
+        enemy = self.position.colors['b' if self.white_to_move else 'w']
+        occupied = self.position.occupied
+        pushes, doubles, promotions = PAWN_PUSHES[color]
+        attacks = PAWN_ATTACK_MASKS[color]
+        board = self.board
+        if pawns is None:
+            pawns = self.position.pieces[color + 'p']
+
+        while pawns:
+            low = pawns & -pawns
+            pawns ^= low
+            sq = low.bit_length() - 1
+            start = COORDS[sq]
+
+            # 1-space move, then the 2-space move from the starting sector
+            targets = attacks[sq] & enemy
+            target = pushes[sq]
+            if target is not None and not occupied & BIT[target]:
+                targets |= BIT[target]
+                double = doubles[sq]
+                if double is not None and not occupied & BIT[double]:
+                    moves.append(Move(start, COORDS[double], board))
+
+            # Captures move one sector forward and one annulus in or out
+            while targets:
+                low = targets & -targets
+                targets ^= low
+                if promotions & low:
+                    for piece in PROMOTION_PIECES:
+                        moves.append(Move(start, COORDS[low.bit_length() - 1], board, piece))
+                else:
+                    moves.append(Move(start, COORDS[low.bit_length() - 1], board))
+
+    def get_slider_moves(self, a, sect, moves, rays):
+        # Walks each ray from the square until it is blocked, capturing an
+        # enemy piece that blocks it. The two rays around a ring each run a
+        # full lap, so the second one stops where the first one ended
+        enemy = self.position.colors['b' if self.white_to_move else 'w']
+        occupied = self.position.occupied
+
+        reached = 0
+        for ray in rays[square(a, sect)]:
+            for sq in ray:
+                bit = BIT[sq]
+                if reached & bit:
+                    break
+                reached |= bit
+                if occupied & bit:
+                    if enemy & bit:
+                        moves.append(Move((a, sect), COORDS[sq], self.board))
+                    break
+                moves.append(Move((a, sect), COORDS[sq], self.board))
+
+    def get_step_moves(self, a, sect, moves, masks):
+        # Adds a move to every square in the mask not held by a friendly piece
+        own = self.position.colors['w' if self.white_to_move else 'b']
+
+        targets = masks[square(a, sect)] & ~own
+        while targets:
+            low = targets & -targets
+            moves.append(Move((a, sect), COORDS[low.bit_length() - 1], self.board))
+            targets ^= low
 
-            # Adjust for circular board boundaries
-            if new_sect == -1:
-                new_sect = 15
-            elif new_sect == 16:
-                new_sect = 0
-            elif new_sect == -2:
-                new_sect = 14
-            elif new_sect == 17:
-                new_sect = 1
+    def get_rook_moves(self, a, sect, moves):
+        self.get_slider_moves(a, sect, moves, ROOK_RAYS)
 
-            if not is_valid_space(new_a, new_sect):
-                return
+    def get_bishop_moves(self, a, sect, moves):
+        self.get_slider_moves(a, sect, moves, BISHOP_RAYS)
 
-            if self.board[new_a][new_sect] == "--":
-                # Empty space, valid knight move
-                moves.append(Move((a, sect), (new_a, new_sect), self.board))
-            elif self.board[new_a][new_sect][0] == enemy_color:
-                # Capturing opponent's piece, valid knight move
-                moves.append(Move((a, sect), (new_a, new_sect), self.board))
+    def get_queen_moves(self, a, sect, moves):
+        self.get_slider_moves(a, sect, moves, QUEEN_RAYS)
 
-        # Check moves in all directions
-        for d in directions:
-            check(d, a, sect)
+    def get_king_moves(self, a, sect, moves):
+        self.get_step_moves(a, sect, moves, KING_MASKS)
+
+    def get_knight_moves(self, a, sect, moves):
+        self.get_step_moves(a, sect, moves, KNIGHT_MASKS)
 
 
 class Move():
-    # Represents a chess move
+    # Represents a chess move. Slots keep each instance free of a __dict__,
+    # since moves are created in bulk by move generation
+    __slots__ = ('start_ann', 'start_sect', 'end_ann', 'end_sect', 'start_sq', 'end_sq',
+                 'piece_moved', 'piece_captured', 'promotion', 'move_id')
+
     ann_to_rank = {0: '1', 1: '2', 2: '3', 3: '4'}
     rank_to_ann = {v: k for k, v in ann_to_rank.items()}
 
@@ -463,19 +536,33 @@ class Move():
                     8: 'd', 9: 'c', 10: 'b', 11: 'a', 12: 'p', 13: 'o', 14: 'n', 15: 'm'}
     file_to_sect = {v: k for k, v in sect_to_file.items()}
 
-    def __init__(self, start_space, end_space, board):
-        # Initializes a move
+    def __init__(self, start_space, end_space, board, promotion=None):
+        # Initializes a move. promotion is the piece a pawn promotes to, as a
+        # letter of PROMOTION_PIECES
         self.start_ann = start_space[0]
         self.start_sect = start_space[1]
 
         self.end_ann = end_space[0]
         self.end_sect = end_space[1]
 
+        # Square indices (annulus*16 + sector) as used by the bitboards
+        self.start_sq = self.start_ann * SECTORS + self.start_sect
+        self.end_sq = self.end_ann * SECTORS + self.end_sect
+
         self.piece_moved = board[self.start_ann][self.start_sect]
         self.piece_captured = board[self.end_ann][self.end_sect]
+        # The piece placed on the end square instead of the pawn, e.g. "wQ"
+        self.promotion = self.piece_moved[0] + promotion if promotion else None
+
+        self.move_id = Move.encode(self.start_sq, self.end_sq, promotion)
 
-        self.move_id = self.start_ann * 1000 + self.start_sect * 100 + \
-            self.end_ann * 10 + self.end_sect
+    @staticmethod
+    def encode(start_sq, end_sq, promotion=None):
+        # Packs a move into an int: 6 bits for the start square, 6 for the
+        # end, then 1 to 4 for a promotion to one of PROMOTION_PIECES
+        if promotion:
+            return (PROMOTION_PIECES.index(promotion) + 1) << 12 | start_sq << 6 | end_sq
+        return start_sq << 6 | end_sq
 
     def __eq__(self, other):
         # Overrides the equals method
@@ -483,19 +570,29 @@ class Move():
             return self.move_id == other.move_id
         return False
 
+    def __hash__(self):
+        return self.move_id
+
     def get_chess_notation(self):
         # Gets the chess notation for the move
         piece_char = ''
         if self.piece_moved[1] != 'p':
             piece_char = self.piece_moved[1]
 
+        promotion = '=' + self.promotion[1] if self.promotion else ''
         if self.piece_captured == "--":
-            return piece_char + self.get_file_rank(self.end_ann, self.end_sect)
+            return piece_char + self.get_file_rank(self.end_ann, self.end_sect) + promotion
         else:
             piece2_char = ''
             if self.piece_captured[1] != 'p':
                 piece2_char = self.piece_captured[1]
-            return piece_char + self.get_file_rank(self.start_ann, self.start_sect) + 'x' + piece2_char + self.get_file_rank(self.end_ann, self.end_sect)
+            return piece_char + self.get_file_rank(self.start_ann, self.start_sect) + 'x' + piece2_char + self.get_file_rank(self.end_ann, self.end_sect) + promotion
+
+    def get_long_notation(self):
+        # Gets the start and end squares of the move, e.g. "b1c1", then the
+        # promotion piece in lowercase, e.g. "g1h1q"
+        notation = self.get_file_rank(self.start_ann, self.start_sect) + self.get_file_rank(self.end_ann, self.end_sect)
+        return notation + self.promotion[1].lower() if self.promotion else notation
 
     def get_file_rank(self, a, sect):
         # Gets the file and rank for a given position
@@ -0,0 +1,159 @@
+"""
+Opening book: moves played from each position of a set of game records,
+with how often they were played and how they scored
+
+The book is a file of fixed-size entries sorted by Zobrist key (see
+zobrist.py) and move id, after a 16-byte header:
+
+    key      uint64   Board.zobrist_key of the position
+    move     uint32   Move.move_id of the move played
+    games    uint32   games in which the move was played there
+    points   uint32   half points the side to move scored with it
+
+OpeningBook maps the file with mmap and finds a position's moves with a
+binary search, so probing costs O(log n) reads whatever the book size.
+
+    python3 book.py build games.pgn --output book.bin --plies 20
+    python3 book.py probe book.bin --moves b1c1 j1k1
+"""
+
+import argparse
+import mmap
+import random
+import struct
+
+from board import Board
+from pgn import read_games
+
+MAGIC = b"CCBK"
+VERSION = 1
+HEADER = struct.Struct("<4sI Q")
+ENTRY = struct.Struct("<QIII")
+
+# Half points scored by the side to move, by result and side
+HALF_POINTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}
+
+
+def collect(games, max_plies=20, stats=None):
+    # Adds up (games, half points) for every (key, move id) played in the
+    # first max_plies plies of finished games
+    if stats is None:
+        stats = {}
+    for game in games:
+        points = HALF_POINTS.get(game.result)
+        if points is None:
+            continue
+        board = game.start_board()
+        try:
+            for ply, move in enumerate(game.play(board)):
+                if ply >= max_plies:
+                    break
+                entry = (board.zobrist_key, move.move_id)
+                games_played, half_points = stats.get(entry, (0, 0))
+                stats[entry] = (games_played + 1, half_points + points[0 if board.white_to_move else 1])
+        except ValueError:
+            # Moves after an illegal one are left out
+            continue
+    return stats
+
+
+def write_book(path, stats, min_games=1):
+    # Writes the entries with at least min_games games, sorted for lookup
+    entries = sorted((key, move_id, games, points) for (key, move_id), (games, points) in stats.items()
+                     if games >= min_games)
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(entries)))
+        for entry in entries:
+            file.write(ENTRY.pack(*entry))
+    return len(entries)
+
+
+class OpeningBook:
+    # Reads a book file through mmap
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < HEADER.size:
+            self.data.close()
+            raise ValueError("Not an opening book: " + path)
+        magic, version, self.size = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            self.data.close()
+            raise ValueError("Not an opening book: " + path)
+        if len(self.data) < HEADER.size + self.size * ENTRY.size:
+            self.data.close()
+            raise ValueError("Truncated opening book: " + path)
+
+    def close(self):
+        self.data.close()
+
+    def entry(self, i):
+        return ENTRY.unpack_from(self.data, HEADER.size + i * ENTRY.size)
+
+    def lookup(self, key):
+        # Gets (move id, games, half points) of every move stored for a key
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        moves = []
+        for i in range(low, self.size):
+            entry_key, move_id, games, points = self.entry(i)
+            if entry_key != key:
+                break
+            moves.append((move_id, games, points))
+        return moves
+
+    def moves(self, board):
+        # Gets (Move, games, score from 0 to 1) for the book moves that are
+        # valid on the board, most played first
+        valid = board.get_valid_move_ids()
+        moves = [(valid[move_id], games, points / (2 * games))
+                 for move_id, games, points in self.lookup(board.zobrist_key) if move_id in valid]
+        moves.sort(key=lambda entry: entry[1], reverse=True)
+        return moves
+
+    def choose(self, board, rng=random):
+        # Picks a book move for the board at random, weighted by how often it
+        # was played, or returns None when the position is not in the book
+        moves = self.moves(board)
+        if not moves:
+            return None
+        return rng.choices([move for move, _, _ in moves], weights=[games for _, games, _ in moves])[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or read an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="build a book from game records")
+    build.add_argument("paths", nargs="+", help="game record files (see pgn.py)")
+    build.add_argument("--output", default="book.bin")
+    build.add_argument("--plies", type=int, default=20, help="plies of each game to include")
+    build.add_argument("--min-games", type=int, default=2, help="leave out moves played fewer times")
+
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("--moves", nargs="*", default=[],
+                       help="long-notation moves played from the starting position")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        stats = {}
+        for path in args.paths:
+            collect(read_games(path), args.plies, stats)
+        count = write_book(args.output, stats, args.min_games)
+        print("%d positions and moves seen, %d written to %s" % (len(stats), count, args.output))
+    else:
+        board = Board()
+        for notation in args.moves:
+            board.make_move(board.parse_move(notation))
+        for move, games, score in OpeningBook(args.book).moves(board):
+            print("%s  games %d  score %.0f%%" % (move.get_long_notation(), games, 100 * score))
+
+
+if __name__ == "__main__":
+    main()
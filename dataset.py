@@ -0,0 +1,173 @@
+"""
+Training data: every position of a set of game records as NumPy arrays
+
+Games are replayed through Board and each position before a move becomes
+one row of a set of .npy files in an output directory:
+
+    positions.npy   (N, 4, 16) int8   piece codes of bitboard.PIECE_CODES
+    white.npy       (N,) int8         1 when white is to move
+    moves.npy       (N,) int32        the move played, as Move.move_id
+    results.npy     (N,) int8         result for the side to move: 1, 0 or -1
+    games.npy       (N,) int32        index of the game the position is from
+
+Rows are written as they are produced, so datasets can be larger than
+memory. open_dataset maps the files with np.load(mmap_mode='r'), so rows
+are read straight from disk when they are used.
+
+    python3 dataset.py games.pgn --output data
+"""
+
+import argparse
+import os
+import struct
+import time
+from array import array
+
+from bitboard import SQUARES, PIECES
+from constants import ANNULI, SECTORS
+from pgn import read_games
+
+# Score of a finished game for white, games without a result are skipped
+RESULT_VALUES = {"1-0": 1, "0-1": -1, "1/2-1/2": 0}
+
+# name: (array typecode, NumPy dtype, shape of one row)
+COLUMNS = {
+    "positions": ('b', "|i1", (ANNULI, SECTORS)),
+    "white": ('b', "|i1", ()),
+    "moves": ('i', "<i4", ()),
+    "results": ('b', "|i1", ()),
+    "games": ('i', "<i4", ()),
+}
+
+# Bytes reserved at the start of each file for the .npy header, which is
+# rewritten with the final row count when the file is closed
+HEADER_BYTES = 128
+
+
+def npy_header(dtype, shape):
+    # Version 1.0 .npy header, padded with spaces to HEADER_BYTES
+    text = "{'descr': '%s', 'fortran_order': False, 'shape': %r, }" % (dtype, tuple(shape))
+    text = text.ljust(HEADER_BYTES - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(text)) + text.encode("latin1")
+
+
+class ArrayWriter:
+    # Appends rows to a .npy file without holding them in memory
+    def __init__(self, path, typecode, dtype, row_shape, buffer_rows=65536):
+        self.file = open(path, "wb")
+        self.typecode = typecode
+        self.dtype = dtype
+        self.row_shape = row_shape
+        self.row_size = 1
+        for size in row_shape:
+            self.row_size *= size
+        self.buffer = array(typecode)
+        self.buffer_size = buffer_rows * self.row_size
+        self.rows = 0
+        self.file.write(npy_header(dtype, (0,) + row_shape))
+
+    def append(self, values):
+        # Adds the values of one or more rows, flattened
+        self.buffer.extend(values)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def append_bytes(self, data):
+        # Adds rows given as raw bytes in the array's machine format
+        self.buffer.frombytes(data)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.rows += len(self.buffer) // self.row_size
+        self.buffer.tofile(self.file)
+        self.buffer = array(self.typecode)
+
+    def close(self):
+        self.flush()
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, (self.rows,) + self.row_shape))
+        self.file.close()
+
+
+def game_rows(game):
+    # Yields (encoded board, white to move, move id) for every move of a game
+    board = game.start_board()
+    for move in game.play(board):
+        yield board.encode(), board.white_to_move, move.move_id
+
+
+def export(paths, output, progress=None):
+    # Writes the positions of all games in the record files to the output
+    # directory. Returns (games, positions, skipped games)
+    os.makedirs(output, exist_ok=True)
+    writers = {name: ArrayWriter(os.path.join(output, name + ".npy"), *column)
+               for name, column in COLUMNS.items()}
+    games = positions = skipped = 0
+
+    try:
+        for path in paths:
+            for game in read_games(path):
+                result = RESULT_VALUES.get(game.result)
+                if result is None:
+                    skipped += 1
+                    continue
+                try:
+                    rows = list(game_rows(game))
+                except ValueError:
+                    skipped += 1
+                    continue
+
+                for encoded, white, move_id in rows:
+                    writers["positions"].append_bytes(encoded[:SQUARES])
+                    writers["white"].append((white,))
+                    writers["moves"].append((move_id,))
+                    writers["results"].append((result if white else -result,))
+                    writers["games"].append((games,))
+                games += 1
+                positions += len(rows)
+                if progress is not None:
+                    progress(games, positions)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return games, positions, skipped
+
+
+def open_dataset(directory):
+    # Maps the arrays written by export, without reading them into memory
+    import numpy as np
+
+    return {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode='r') for name in COLUMNS}
+
+
+def to_planes(positions):
+    # Expands (N, 4, 16) piece codes into (N, 12, 4, 16) int8 planes, one
+    # per piece in the order of bitboard.PIECES, with 1 where it stands
+    import numpy as np
+
+    codes = np.arange(1, len(PIECES) + 1, dtype=np.int8).reshape(1, -1, 1, 1)
+    return (np.asarray(positions)[:, None] == codes).astype(np.int8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the positions of game records as NumPy arrays")
+    parser.add_argument("paths", nargs="+", help="game record files (see pgn.py)")
+    parser.add_argument("--output", default="data", help="directory for the .npy files")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    def progress(games, positions):
+        if games % 10000 == 0:
+            print("games %d  positions %d  positions/s %.0f" % (
+                games, positions, positions / (time.perf_counter() - start)), flush=True)
+
+    games, positions, skipped = export(args.paths, args.output, progress)
+    elapsed = time.perf_counter() - start
+    print("games %d  positions %d  skipped %d  time %.1fs  positions/s %.0f" % (
+        games, positions, skipped, elapsed, positions / elapsed if elapsed else 0))
+
+
+if __name__ == "__main__":
+    main()
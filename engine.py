@@ -0,0 +1,208 @@
+"""
+Text protocol for the engine over stdin/stdout, modeled on UCI
+
+    uci                                   -> id lines, uciok
+    isready                               -> readyok
+    ucinewgame                            clears the transposition table
+    setoption name Hash value <MB>
+    setoption name TablebasePath value <directory>
+    setoption name BookPath value <file>        book moves are played without searching
+    position startpos [moves b1c1 ...]
+    position fen <fen> [moves b1c1 ...]
+    go [depth N] [nodes N] [movetime MS] [wtime MS btime MS winc MS binc MS] [infinite]
+    stop                                  -> bestmove <move>
+    quit
+
+Moves use long notation (Move.get_long_notation) and FEN strings are the
+format of Board.from_fen. While searching the engine prints
+"info depth D score cp S nodes N nps N time MS pv ..." after every
+iteration. The search runs in a background thread, so stop and isready are
+answered straight away.
+
+    python3 engine.py
+"""
+
+import sys
+import threading
+
+from board import Board
+from book import OpeningBook
+from search import Search, MATE, MATE_BOUND
+from profiling import enable_from_environment
+from tablebase import Tablebases
+from zobrist import TranspositionTable
+
+
+class Engine:
+    # Keeps the position and search state between protocol commands
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.board = Board()
+        self.tt = TranspositionTable()
+        self.tablebases = None
+        self.book = None
+        self.search = None
+        self.thread = None
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def handle(self, line):
+        # Handles one command, returns False on quit
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+
+        if command == "uci":
+            self.send("id name circular-chess")
+            self.send("option name Hash type spin default 16 min 1 max 4096")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("option name BookPath type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stop()
+            self.tt.clear()
+        elif command == "setoption":
+            self.set_option(args)
+        elif command == "position":
+            self.stop()
+            self.set_position(args)
+        elif command == "go":
+            self.stop()
+            self.go(args)
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            return False
+        else:
+            self.send("info string unknown command " + command)
+        return True
+
+    def set_option(self, args):
+        # setoption name <name> value <value>
+        if "name" not in args or "value" not in args:
+            return
+        name = " ".join(args[args.index("name") + 1:args.index("value")])
+        value = " ".join(args[args.index("value") + 1:])
+        if name.lower() == "hash":
+            self.stop()
+            try:
+                self.tt = TranspositionTable(max(1, int(value)))
+            except ValueError:
+                self.send(("info string invalid Hash value " + value).rstrip())
+        elif name.lower() == "tablebasepath":
+            self.stop()
+            try:
+                self.tablebases = Tablebases(value) if value and value != "<empty>" else None
+            except OSError as error:
+                self.tablebases = None
+                self.send("info string " + str(error))
+        elif name.lower() == "bookpath":
+            try:
+                self.book = OpeningBook(value) if value and value != "<empty>" else None
+            except (OSError, ValueError) as error:
+                self.book = None
+                self.send("info string " + str(error))
+
+    def set_position(self, args):
+        # position startpos|fen <fen> [moves ...]
+        moves = []
+        if "moves" in args:
+            moves = args[args.index("moves") + 1:]
+            args = args[:args.index("moves")]
+
+        try:
+            if args and args[0] == "fen":
+                board = Board.from_fen(" ".join(args[1:]))
+            else:
+                board = Board()
+            for notation in moves:
+                board.make_move(board.parse_move(notation))
+        except ValueError as error:
+            self.send("info string " + str(error))
+            return
+        self.board = board
+
+    def go(self, args):
+        # Starts searching in the background with the limits given, or
+        # answers straight away with a move from the opening book
+        limits = {}
+        for i, token in enumerate(args):
+            if token in ("depth", "nodes", "movetime", "wtime", "btime", "winc", "binc", "movestogo"):
+                try:
+                    limits[token] = int(args[i + 1])
+                except (IndexError, ValueError):
+                    self.send("info string invalid go " + " ".join(args[i:i + 2]))
+                    return
+
+        if self.book is not None and "infinite" not in args:
+            move = self.book.choose(self.board)
+            if move is not None:
+                self.send("info string book move")
+                self.send("bestmove " + move.get_long_notation())
+                return
+
+        max_time = None
+        if "movetime" in limits:
+            max_time = limits["movetime"] / 1000
+        elif "infinite" not in args:
+            side = "w" if self.board.white_to_move else "b"
+            if side + "time" in limits:
+                remaining = limits[side + "time"] / 1000
+                increment = limits.get(side + "inc", 0) / 1000
+                max_time = remaining / limits.get("movestogo", 30) + increment / 2
+
+        # The clock starts now, and a stop arriving before the thread runs still counts
+        self.search = Search(self.board, self.tt, self.tablebases)
+        self.search.reset(limits.get("nodes"), max_time)
+        self.thread = threading.Thread(target=self.run_search, args=(self.search, limits.get("depth", 64)))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run_search(self, search, max_depth):
+        move, score, pv = search.iterate(max_depth, self.send_info)
+        self.send("bestmove " + (move.get_long_notation() if move is not None else "(none)"))
+
+    def send_info(self, depth, score, nodes, seconds, pv):
+        if abs(score) > MATE_BOUND:
+            plies = MATE - abs(score)
+            score_text = "mate %d" % ((plies + 1) // 2 if score > 0 else -(plies // 2))
+        else:
+            score_text = "cp %d" % score
+        self.send("info depth %d score %s nodes %d nps %d time %d pv %s" % (
+            depth, score_text, nodes, nodes / seconds if seconds else 0, seconds * 1000,
+            " ".join(move.get_long_notation() for move in pv)))
+
+    def stop(self):
+        # Stops a running search and waits for it to print its bestmove
+        if self.thread is not None:
+            self.search.stop()
+            self.wait()
+
+    def wait(self):
+        # Waits for a running search to finish by itself
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def main():
+    enable_from_environment()
+    engine = Engine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    else:
+        # Input ended (e.g. commands piped in), let the last search finish
+        engine.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Static evaluation: material, piece-square tables and mobility
+
+evaluate scores one Board for the search. evaluate_batch scores many
+positions at once with NumPy, given as an (N, 4, 16) int8 array of the
+piece codes of bitboard.PIECE_CODES (0 for an empty square), which is the
+first 64 bytes of Board.encode(). Both give the same scores.
+
+    positions, white_to_move = encode_positions(boards)
+    scores = evaluate_batch(positions, white_to_move)
+
+NumPy is only imported by the batch functions, so the search does not need it.
+"""
+
+from functools import lru_cache
+
+from constants import ANNULI, SECTORS
+from bitboard import SQUARES, PIECES, PIECE_CODES, BIT, ROTATE_HIGH, ROTATE_LOW, iter_squares
+from tables import (COORDS, KNIGHT_MASKS, BISHOP_RAYS, ROOK_RAYS, QUEEN_RAYS,
+                    BISHOP_DIRECTIONS, ROOK_DIRECTIONS, KNIGHT_JUMPS)
+
+PIECE_VALUES = {'p': 100, 'N': 300, 'B': 300, 'R': 500, 'Q': 900, 'K': 0}
+
+# Bonus per square a piece can move to (see Board.get_slider_moves). A rook
+# on an empty ring counts every square twice, once in each direction
+MOBILITY_WEIGHTS = {'p': 0, 'N': 4, 'B': 3, 'R': 2, 'Q': 1, 'K': 0}
+
+# Bonus for a pawn by the number of squares it has advanced from its start
+PAWN_ADVANCE = (0, 5, 10, 20, 30, 45, 60)
+
+# Bonus by annulus, innermost first. Knights on the inner and outer rings
+# have 4 jumps instead of 6
+KNIGHT_RINGS = (-10, 0, 0, -10)
+
+# Penalty per sector the king stands away from its own side of the board
+KING_DISTANCE = -8
+
+# White's pieces start on sectors 10-13. Black's start on the mirror image,
+# sector 15 - sect, where the pawns move in the opposite direction
+WHITE_HOME = (10, 11, 12, 13)
+
+
+def mirror(sq):
+    # The square in the same annulus reflected onto the other player's side
+    a, sect = COORDS[sq]
+    return a * SECTORS + SECTORS - 1 - sect
+
+
+def pawn_advance(sect):
+    # Squares a white pawn on the sector has moved from its start: pawns of
+    # the right half go down from sector 10, those of the left half up from 13
+    if 4 <= sect <= 10:
+        return 10 - sect
+    if sect >= 13 or sect <= 3:
+        return (sect - 13) % SECTORS
+    return 0
+
+
+def home_distance(sect):
+    # Sectors between a square and the nearest white home sector, around the ring
+    return min(min((sect - home) % SECTORS, (home - sect) % SECTORS) for home in WHITE_HOME)
+
+
+def build_piece_square_table(kind):
+    # Material plus positional bonus of a white piece on every square
+    table = []
+    for sq in range(SQUARES):
+        a, sect = COORDS[sq]
+        value = PIECE_VALUES[kind]
+        if kind == 'p':
+            value += PAWN_ADVANCE[pawn_advance(sect)]
+        elif kind == 'N':
+            value += KNIGHT_RINGS[a]
+        elif kind == 'K':
+            value += KING_DISTANCE * home_distance(sect)
+        table.append(value)
+    return table
+
+
+# PIECE_SQUARE[piece][sq] is the value of the piece on the square for its own side
+PIECE_SQUARE = {}
+for _kind in PIECE_VALUES:
+    PIECE_SQUARE['w' + _kind] = build_piece_square_table(_kind)
+    PIECE_SQUARE['b' + _kind] = [PIECE_SQUARE['w' + _kind][mirror(sq)] for sq in range(SQUARES)]
+
+SLIDER_RAYS = {'B': BISHOP_RAYS, 'R': ROOK_RAYS, 'Q': QUEEN_RAYS}
+MOBILITY_DIRECTIONS = {'N': KNIGHT_JUMPS, 'B': BISHOP_DIRECTIONS, 'R': ROOK_DIRECTIONS,
+                       'Q': BISHOP_DIRECTIONS + ROOK_DIRECTIONS}
+
+
+def slider_mobility(sq, rays, occupied, own):
+    # Number of moves along the rays, stopping at the first piece and
+    # counting it when it can be captured. Squares the other way around a
+    # ring already reached are not counted again
+    count = 0
+    reached = 0
+    for ray in rays[sq]:
+        for target in ray:
+            bit = BIT[target]
+            if reached & bit:
+                break
+            reached |= bit
+            if occupied & bit:
+                if not own & bit:
+                    count += 1
+                break
+            count += 1
+    return count
+
+
+def evaluate(board):
+    # Score of the position in centipawns, from the point of view of the
+    # player to move
+    position = board.position
+    occupied = position.occupied
+    score = 0
+    for piece, bb in position.pieces.items():
+        if not bb:
+            continue
+        color, kind = piece
+        table = PIECE_SQUARE[piece]
+        weight = MOBILITY_WEIGHTS[kind]
+        own = position.colors[color]
+
+        total = 0
+        for sq in iter_squares(bb):
+            total += table[sq]
+            if kind == 'N':
+                total += weight * bin(KNIGHT_MASKS[sq] & ~own).count('1')
+            elif weight:
+                total += weight * slider_mobility(sq, SLIDER_RAYS[kind], occupied, own)
+        score += total if color == 'w' else -total
+    return score if board.white_to_move else -score
+
+
+def encode_positions(boards):
+    # Gets the (N, 4, 16) int8 array of piece codes and the (N,) bool array
+    # of the side to move for a sequence of boards
+    import numpy as np
+
+    data = b"".join(board.encode() for board in boards)
+    encoded = np.frombuffer(data, dtype=np.int8).reshape(-1, SQUARES + 1)
+    positions = encoded[:, :SQUARES].reshape(-1, ANNULI, SECTORS)
+    return positions, encoded[:, SQUARES] != 0
+
+
+@lru_cache(maxsize=None)
+def batch_tables():
+    # NumPy versions of the tables above, built on first use
+    import numpy as np
+
+    # Value of each piece code on each square, positive for white
+    values = np.zeros((len(PIECES) + 1, SQUARES), dtype=np.int32)
+    for piece, code in PIECE_CODES.items():
+        values[code] = np.array(PIECE_SQUARE[piece]) * (1 if piece[0] == 'w' else -1)
+
+    rotate_high = [np.uint64(mask) for mask in ROTATE_HIGH]
+    rotate_low = [np.uint64(mask) for mask in ROTATE_LOW]
+    return values, rotate_high, rotate_low
+
+
+def shift_batch(bb, direction, rotate_high, rotate_low):
+    # Moves every bit of an array of bitboards one step in a direction, see
+    # tables.step. Bits leaving through the inner or outer ring are dropped
+    da, ds = direction
+    if da > 0:
+        bb = bb << (SECTORS * da)
+    elif da < 0:
+        bb = bb >> (SECTORS * -da)
+    n = ds % SECTORS
+    if n:
+        bb = ((bb << n) & rotate_high[n]) | ((bb >> (SECTORS - n)) & rotate_low[n])
+    return bb
+
+
+def popcount_batch(bb):
+    # Number of set bits of every bitboard in an array
+    import numpy as np
+
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bb).astype(np.int32)
+    return np.unpackbits(bb.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1, dtype=np.int32)
+
+
+def evaluate_batch(positions, white_to_move=None, chunk_size=65536):
+    # Scores an (N, 4, 16) int8 array of piece codes, a chunk of positions
+    # at a time. Returns an (N,) int32 array of scores from white's point of
+    # view, or from the side to move when white_to_move is given as an (N,)
+    # bool array. Matches evaluate position by position
+    import numpy as np
+
+    values, rotate_high, rotate_low = batch_tables()
+    codes = np.asarray(positions, dtype=np.int8).reshape(-1, SQUARES)
+    scores = np.empty(len(codes), dtype=np.int32)
+
+    for start in range(0, len(codes), chunk_size):
+        chunk = codes[start:start + chunk_size]
+
+        # Material and piece-square tables
+        score = values[chunk.astype(np.intp), np.arange(SQUARES)].sum(axis=1)
+
+        # One bitboard per piece for every position, as in bitboard.Position
+        pieces = {piece: np.packbits(chunk == code, axis=1, bitorder='little').view('<u8')[:, 0]
+                  for piece, code in PIECE_CODES.items()}
+        colors = {color: np.bitwise_or.reduce([pieces[color + kind] for kind in PIECE_VALUES])
+                  for color in ('w', 'b')}
+        empty = ~(colors['w'] | colors['b'])
+
+        # Mobility is counted for all pieces of a kind at once, one step at a
+        # time along each direction. The pieces still sliding land on
+        # different squares, so the popcount of the squares they can move to
+        # adds up the moves of each piece
+        for color, sign in (('w', 1), ('b', -1)):
+            targets = ~colors[color]
+            for kind, weight in MOBILITY_WEIGHTS.items():
+                if not weight:
+                    continue
+                for direction in MOBILITY_DIRECTIONS[kind]:
+                    steps = SECTORS - 1 if direction[0] == 0 else 1 if kind == 'N' else ANNULI - 1
+                    sliding = pieces[color + kind]
+                    for _ in range(steps):
+                        sliding = shift_batch(sliding, direction, rotate_high, rotate_low)
+                        score += sign * weight * popcount_batch(sliding & targets)
+                        sliding &= empty
+                        if not sliding.any():
+                            break
+
+            # The two ring directions each run a full lap, so they overlap on a
+            # ring with no other piece (30 squares for 15) or with a single
+            # enemy piece, reached both ways round (16 for 15)
+            enemy = colors['b' if color == 'w' else 'w']
+            for a in range(ANNULI):
+                ring = np.uint64(((1 << SECTORS) - 1) << (SECTORS * a))
+                on_ring = popcount_batch(colors[color] & ring)
+                enemies = popcount_batch(enemy & ring)
+                alone = (on_ring == 1) & (enemies == 0)
+                facing_one = (on_ring == 1) & (enemies == 1)
+                for kind in ('R', 'Q'):
+                    mine = popcount_batch(pieces[color + kind] & ring)
+                    score -= sign * MOBILITY_WEIGHTS[kind] * mine * np.where(alone, SECTORS - 1, facing_one)
+
+        scores[start:start + len(chunk)] = score
+
+    if white_to_move is not None:
+        scores = np.where(np.asarray(white_to_move, dtype=bool), scores, -scores).astype(np.int32)
+    return scores
@@ -0,0 +1,262 @@
+"""
+Game database: finds the games that reached a position, and what was played
+next, in a SQLite file
+
+Games from record files (see pgn.py) are replayed through Board and every
+position is stored with its Zobrist key (see zobrist.py):
+
+    games       id, source file, number in the file, headers (JSON), result, plies
+    positions   key, game, ply, move played there (Move.move_id, NULL after
+                the last move), half points the side to move scored (NULL
+                when the game has no result)
+    sources     path, number of games ingested from it, byte offset after
+                the last of them
+
+positions is a WITHOUT ROWID table keyed by (key, game, ply), so the rows
+of a position are stored together and a query reads one range of the
+index. Ingesting a file again seeks to the stored offset and only parses
+and adds the games appended since the last time. Games are replayed on a
+pool of worker processes while the main process writes them.
+
+    python3 gamedb.py ingest games.pgn selfplay.pgn --db games.db
+    python3 gamedb.py query --db games.db --moves b1c1 j1k1
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from board import Board
+from book import HALF_POINTS
+from pgn import read_games
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    result TEXT NOT NULL,
+    plies INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS positions (
+    key INTEGER NOT NULL,
+    game INTEGER NOT NULL,
+    ply INTEGER NOT NULL,
+    move INTEGER,
+    points INTEGER,
+    PRIMARY KEY (key, game, ply)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    games INTEGER NOT NULL,
+    byte_offset INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Games replayed by a worker per task
+CHUNK_GAMES = 200
+
+
+def signed_key(key):
+    # SQLite integers are signed 64-bit, Zobrist keys are unsigned
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+def game_positions(game):
+    # Gets (key, ply, move id, half points of the side to move) for every
+    # position of a game, the last one with no move. Raises ValueError for
+    # a game with a move the piece cannot make
+    points = HALF_POINTS.get(game.result)
+    board = game.start_board()
+    rows = []
+    for ply, move in enumerate(game.play(board)):
+        rows.append((signed_key(board.zobrist_key), ply, move.move_id,
+                     points[0 if board.white_to_move else 1] if points else None))
+    rows.append((signed_key(board.zobrist_key), len(game.moves), None,
+                 points[0 if board.white_to_move else 1] if points else None))
+    return rows
+
+
+def _index_chunk(games):
+    # Runs in a worker process: the positions of each game of a chunk, or
+    # None for games that cannot be replayed
+    results = []
+    for game in games:
+        try:
+            results.append((game, game_positions(game)))
+        except ValueError:
+            results.append((game, None))
+    return results
+
+
+def chunks(games, size):
+    chunk = []
+    for game in games:
+        chunk.append(game)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class GameDatabase:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(sources)")]
+        if "byte_offset" not in columns:
+            # Databases from before offsets were stored
+            self.connection.execute("ALTER TABLE sources ADD COLUMN byte_offset INTEGER NOT NULL DEFAULT 0")
+
+    def close(self):
+        self.connection.close()
+
+    def ingested(self, path):
+        # (number of games, byte offset after them) of a file already in the database
+        row = self.connection.execute("SELECT games, byte_offset FROM sources WHERE path = ?", (path,)).fetchone()
+        return row if row else (0, 0)
+
+    def ingest(self, path, workers=None, progress=None):
+        # Adds the games of a record file not yet ingested from it. Each chunk
+        # is committed together with the count of games read, so an
+        # interrupted run carries on where it stopped. Returns (games added,
+        # positions added, games skipped because a move could not be made)
+        path = os.path.abspath(path)
+        workers = workers or os.cpu_count() or 1
+        start, offset = self.ingested(path)
+        # Games of the file written so far, the number of the next one
+        done = start
+        games = positions = skipped = 0
+
+        def new_games():
+            # (game, offset after it) from where the last run stopped. Files
+            # ingested before offsets were stored skip the games counted instead
+            skip = start if start and not offset else 0
+            for number, (game, end) in enumerate(read_games(path, offset, offsets=True)):
+                if number >= skip:
+                    yield game, end
+
+        connection = self.connection
+        connection.execute("PRAGMA synchronous=OFF")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Chunks are written in the order they were read, with a few per
+            # worker in flight
+            pending = deque()
+            work = chunks(new_games(), CHUNK_GAMES)
+            while True:
+                while len(pending) < workers * 2:
+                    chunk = next(work, None)
+                    if chunk is None:
+                        break
+                    pending.append((pool.submit(_index_chunk, [game for game, _ in chunk]), chunk[-1][1]))
+                if not pending:
+                    break
+
+                future, end = pending.popleft()
+                with connection:
+                    for game, rows in future.result():
+                        number = done
+                        done += 1
+                        if rows is None:
+                            skipped += 1
+                            continue
+                        game_id = connection.execute(
+                            "INSERT INTO games (source, number, headers, result, plies) VALUES (?, ?, ?, ?, ?)",
+                            (path, number, json.dumps(game.headers), game.result, len(game.moves))).lastrowid
+                        connection.executemany(
+                            "INSERT OR IGNORE INTO positions (key, game, ply, move, points) VALUES (?, ?, ?, ?, ?)",
+                            [(key, game_id, ply, move_id, points) for key, ply, move_id, points in rows])
+                        games += 1
+                        positions += len(rows)
+                    connection.execute("INSERT OR REPLACE INTO sources (path, games, byte_offset) VALUES (?, ?, ?)",
+                                       (path, done, end))
+                if progress is not None:
+                    progress(games, positions)
+        connection.execute("PRAGMA synchronous=FULL")
+        return games, positions, skipped
+
+    def next_moves(self, board):
+        # Gets (Move, games, score from 0 to 1 or None) for the moves played
+        # from the board's position, most played first
+        valid = {move.move_id: move for move in board.get_all_moves()}
+        rows = self.connection.execute(
+            "SELECT move, COUNT(*), SUM(points), COUNT(points) FROM positions "
+            "WHERE key = ? AND move IS NOT NULL GROUP BY move ORDER BY COUNT(*) DESC",
+            (signed_key(board.zobrist_key),))
+        return [(valid[move_id], games, points / (2 * scored) if scored else None)
+                for move_id, games, points, scored in rows if move_id in valid]
+
+    def games(self, board, limit=20):
+        # Gets (game id, headers, result, ply) of the games that reached the
+        # board's position, first reached at ply
+        rows = self.connection.execute(
+            "SELECT games.id, games.headers, games.result, MIN(positions.ply) FROM positions "
+            "JOIN games ON games.id = positions.game WHERE positions.key = ? "
+            "GROUP BY games.id ORDER BY games.id LIMIT ?",
+            (signed_key(board.zobrist_key), limit))
+        return [(game_id, json.loads(headers), result, ply) for game_id, headers, result, ply in rows]
+
+    def count_games(self, board):
+        row = self.connection.execute("SELECT COUNT(DISTINCT game) FROM positions WHERE key = ?",
+                                      (signed_key(board.zobrist_key),)).fetchone()
+        return row[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index game records by position and query them")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="add game records to the database")
+    ingest.add_argument("paths", nargs="+", help="game record files (see pgn.py)")
+    ingest.add_argument("--db", default="games.db")
+    ingest.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+
+    query = commands.add_parser("query", help="list the games and next moves of a position")
+    query.add_argument("--db", default="games.db")
+    query.add_argument("--fen", help="position to start from instead of the starting position")
+    query.add_argument("--moves", nargs="*", default=[], help="long-notation moves played from it")
+    query.add_argument("--limit", type=int, default=20, help="games to list")
+    args = parser.parse_args()
+
+    database = GameDatabase(args.db)
+    if args.command == "ingest":
+        start = time.perf_counter()
+
+        def progress(games, positions):
+            print("games %d  positions %d  positions/s %.0f" % (
+                games, positions, positions / (time.perf_counter() - start)), flush=True)
+
+        for path in args.paths:
+            games, positions, skipped = database.ingest(path, args.workers, progress)
+            print("%s: %d games, %d positions added, %d skipped" % (path, games, positions, skipped))
+        print("time %.1fs" % (time.perf_counter() - start))
+    else:
+        board = Board.from_fen(args.fen) if args.fen else Board()
+        for notation in args.moves:
+            board.make_move(board.parse_move(notation))
+
+        start = time.perf_counter()
+        moves = database.next_moves(board)
+        games = database.games(board, args.limit)
+        total = database.count_games(board)
+        elapsed = time.perf_counter() - start
+
+        print("%d games reached the position (%.1f ms)" % (total, 1000 * elapsed))
+        for move, count, score in moves:
+            print("  %-8s games %-6d score %s" % (move.get_long_notation(), count,
+                                                  "%.0f%%" % (100 * score) if score is not None else "-"))
+        for game_id, headers, result, ply in games:
+            print("  game %d  %s - %s  %s  ply %d" % (game_id, headers.get("White", "?"),
+                                                      headers.get("Black", "?"), result, ply))
+    database.close()
+
+
+if __name__ == "__main__":
+    main()
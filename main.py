@@ -1,10 +1,28 @@
+import os
+import time
 import pygame as pg
 from constants import *
 from board import Board, Move
+from pgn import Game, write_game
+from book import OpeningBook
+from analysis import Analyzer
+import profiling
 import numpy as np
 
 FPS = 60
 
+# Games are appended here when the window is closed
+GAME_FILE = "games.pgn"
+
+# Opening book (see book.py), its moves are printed after every move if it exists
+BOOK_FILE = "book.bin"
+
+# Endgame tables (see tablebase.py) used by the analysis, if the directory exists
+TABLEBASE_DIR = "tablebases"
+
+# Seconds the computer thinks about each of its moves
+COMPUTER_TIME = 3
+
 # Move this later
 IMAGES = {}
 
@@ -19,7 +37,28 @@ def load_images():
             "images/" + piece + ".png"), (PIECE_SIZE, PIECE_SIZE))
 
 
+def print_book_moves(book, board):
+    # Prints the opening book moves of the position, if it is in the book
+    if book is None:
+        return
+    moves = book.moves(board)
+    if moves:
+        print("Book: " + ", ".join("%s (%d games, %.0f%%)" % (move.get_chess_notation(), games, 100 * score)
+                                   for move, games, score in moves))
+
+
+def computer_to_move(board, computer):
+    # Whether the side to move is played by the computer ('w', 'b' or None)
+    return computer is not None and board.white_to_move == (computer == 'w')
+
+
 def main():
+    profiling.enable_from_environment(rendering=True)
+
+    # Searches run in another process, started before pygame so it does not
+    # inherit the window
+    analyzer = Analyzer(TABLEBASE_DIR if os.path.isdir(TABLEBASE_DIR) else None)
+
     pg.init()
 
     # Set up the game window
@@ -31,9 +70,12 @@ def main():
 
     # Initialize the chess board
     board = Board()
-    valid_moves = board.get_valid_moves()
+    valid_moves = board.get_valid_move_ids()
     move_made = False  # Variable for when a move is made
 
+    book = OpeningBook(BOOK_FILE) if os.path.exists(BOOK_FILE) else None
+    print_book_moves(book, board)
+
     # Load chess piece images
     load_images()
 
@@ -41,13 +83,35 @@ def main():
     space_selected = ()  # Keeps track of the last click of the user (tuple: (annulus, sector))
     player_clicks = []  # Keeps track of player clicks. Array of tuples (list: [tuple])
 
+    redraw_all = True  # Redraw the whole window on the next frame
+    dirty = set()  # Squares to redraw on the next frame (set: {tuple})
+
+    hints = False  # Show the engine's best move, toggled with h
+    computer = None  # Side played by the computer ('w' or 'b'), set with c
+    restart_analysis = False  # Start a new search of the position on the next frame
+    hint_squares = []  # Squares of the engine's best move so far
+    engine_move = None  # Move the computer has chosen, played on the next frame
+    slowest_frame = 0  # Longest frame, in seconds, while the engine was thinking
+
     while run:
+        # Block until something happens while there is nothing to redraw or wait for
+        if redraw_all or dirty or analyzer.running or engine_move is not None:
+            events = pg.event.get()
+        else:
+            events = [pg.event.wait()] + pg.event.get()
+
+        clock.tick(FPS)
+        frame_start = time.perf_counter()
+
         # Process player inputs
-        for event in pg.event.get():
+        for event in events:
             if event.type == pg.QUIT:
                 run = False
                 break
 
+            elif event.type in (pg.VIDEOEXPOSE, pg.VIDEORESIZE, pg.WINDOWSHOWN, pg.WINDOWRESTORED):
+                redraw_all = True
+
             # Mouse handler
             elif event.type == pg.MOUSEBUTTONDOWN:
                 location = pg.mouse.get_pos()  # (x, y) location of the mouse
@@ -57,6 +121,9 @@ def main():
                 a = int((np.sqrt(x**2 + y**2) - MIDDLE_RADIUS) // SPACING)
                 sect = int((np.pi - np.arctan2(y, x)) // SLICE)
 
+                if space_selected:
+                    dirty.add(space_selected)
+
                 if space_selected == (a, sect) or a < 0 or a > 3:  
                     # The user clicked the same space twice or clicked outside of the board
                     space_selected = ()  # Deselect
@@ -66,33 +133,104 @@ def main():
                 else:
                     space_selected = (a, sect)
                     player_clicks.append(space_selected)
+                    dirty.add(space_selected)
 
                 if len(player_clicks) == 2:  # After the second move
-                    move = Move(player_clicks[0], player_clicks[1], board.board)
-                    if move in valid_moves:
+                    clicked = Move(player_clicks[0], player_clicks[1], board.board)
+                    # Pawns reaching a promotion square become queens
+                    move = valid_moves.get(clicked.move_id) or \
+                        valid_moves.get(Move.encode(clicked.start_sq, clicked.end_sq, 'Q'))
+                    if move is not None and not computer_to_move(board, computer):
                         board.make_move(move)
                         print(move.get_chess_notation())
                         move_made = True
+                    dirty.update(player_clicks)
                     space_selected = ()
                     player_clicks = []
 
             # Key handler
             elif event.type == pg.KEYDOWN:
-                if event.key == pg.K_z:
+                if event.key == pg.K_z and board.move_log:
+                    move = board.move_log[-1]
+                    dirty.update([(move.start_ann, move.start_sect), (move.end_ann, move.end_sect)])
                     board.undo_move()
                     move_made = True
-
-        clock.tick(FPS)
+                elif event.key == pg.K_h:
+                    hints = not hints
+                    print("Hints on" if hints else "Hints off")
+                    restart_analysis = True
+                elif event.key == pg.K_c:
+                    # The computer takes over the side to move, or gives it back
+                    computer = None if computer else ('w' if board.white_to_move else 'b')
+                    print("Computer plays " + {'w': "white", 'b': "black", None: "no side"}[computer])
+                    restart_analysis = True
+
+        # Results of the search, without waiting for it
+        for final, depth, score, move in analyzer.poll():
+            if move is None:
+                continue
+            if computer_to_move(board, computer):
+                if final:
+                    engine_move = move
+            elif hints:
+                print("Hint: %s  depth %d  score %d" % (move.get_chess_notation(), depth, score))
+                dirty.update(hint_squares)
+                hint_squares = [(move.start_ann, move.start_sect), (move.end_ann, move.end_sect)]
+                dirty.update(hint_squares)
+
+        if engine_move is not None and not move_made:
+            board.make_move(engine_move)
+            print(engine_move.get_chess_notation())
+            dirty.update([(engine_move.start_ann, engine_move.start_sect), (engine_move.end_ann, engine_move.end_sect)])
+            move_made = True
 
         # Logical updates here
         if move_made:
-            valid_moves = board.get_valid_moves()
+            valid_moves = board.get_valid_move_ids()
+            if board.checkmate:
+                print("Checkmate")
+            elif board.stalemate:
+                print("Stalemate")
+            print_book_moves(book, board)
             move_made = False
-
-        # Render the graphics here
-        board.draw(WINDOW, IMAGES)
-        pg.display.update()
-
+            restart_analysis = True
+
+        # Every move, undo or change of mode stops the search and starts the next one
+        if restart_analysis:
+            engine_move = None
+            dirty.update(hint_squares)
+            hint_squares = []
+            if valid_moves and computer_to_move(board, computer):
+                engine_move = book.choose(board) if book is not None else None
+                if engine_move is None:
+                    analyzer.start(board, max_time=COMPUTER_TIME)
+            elif valid_moves and hints:
+                analyzer.start(board)
+            else:
+                analyzer.cancel()
+            restart_analysis = False
+
+        # Render the graphics here, only updating the parts of the screen that changed
+        highlights = [space_selected] if space_selected else []
+        if redraw_all:
+            board.draw(WINDOW, IMAGES, highlights, hint_squares)
+            pg.display.update()
+        elif dirty:
+            pg.display.update(board.draw_squares(WINDOW, IMAGES, dirty, highlights, hint_squares))
+        redraw_all = False
+        dirty.clear()
+
+        frame_time = time.perf_counter() - frame_start
+        if analyzer.running:
+            slowest_frame = max(slowest_frame, frame_time)
+        if profiling.enabled:
+            profiling.record_frame(frame_time)
+
+    analyzer.close()
+    if slowest_frame:
+        print("Slowest frame while the engine was thinking: %.1f ms" % (1000 * slowest_frame))
+    if board.move_log:
+        write_game(GAME_FILE, Game.from_board(board, {"Event": "Casual game", "Date": time.strftime("%Y.%m.%d")}))
     pg.quit()
 
 
@@ -0,0 +1,211 @@
+"""
+Parallel search: lazy SMP over a pool of worker processes
+
+Every worker searches the whole position, and they all share one
+transposition table in shared memory, so what one worker finds cuts the
+search of the others. At each depth of iterative deepening half the
+workers search one ply deeper, so they run ahead and fill the table for
+the rest. Workers at the same depth rotate the root moves by a different
+amount, so they start in different parts of the tree. The first search to finish ends the iteration, and the others
+are stopped. Positions go to the workers as the 65-byte Board.encode()
+string and moves come back as move ids, so no Board or Move objects are
+pickled.
+
+    python3 parallel.py --workers 8 --time 10
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from board import Board
+from search import Search, INFINITY, MATE, MATE_BOUND, DRAW
+from zobrist import init_worker_table, worker_table, table_words
+
+# Iteration number shared with the main process, set up by _init_worker
+_worker_current = None
+# (search number, SharedSearch) of the search the worker last took part in,
+# kept so its killer moves and history carry over between iterations
+_worker_search = None
+
+
+def _init_worker(table, tt_megabytes, current):
+    global _worker_current
+    init_worker_table(tt_megabytes, table)
+    _worker_current = current
+
+
+class SharedSearch(Search):
+    # Search that also stops once the iteration it is part of is over, and
+    # starts on a different root move from the other workers at its depth
+    def __init__(self, board, tt, current):
+        super().__init__(board, tt)
+        self.current = current
+        self.iteration = 0
+        self.worker = 0
+
+    def check_limits(self):
+        super().check_limits()
+        if self.current.value != self.iteration:
+            self.stopped = True
+
+    def order_moves(self, moves, ply, tt_move):
+        super().order_moves(moves, ply, tt_move)
+        # Workers searching the same depth would otherwise walk the same tree
+        # in the same order, so each pair of workers after the first rotates
+        # the root moves one further
+        rotation = self.worker // 2 % len(moves) if ply == 0 else 0
+        if rotation:
+            moves[:] = moves[rotation:] + moves[:rotation]
+
+
+def _search_depth(task):
+    # Runs in a worker process: searches the position to depth with the shared
+    # table. Returns (depth, score, pv as move ids, nodes, whether it was
+    # stopped before finishing)
+    global _worker_search
+    number, position, keys, depth, worker, iteration, age, deadline = task
+    if _worker_current.value != iteration:
+        return depth, 0, [], 0, True
+
+    if _worker_search is None or _worker_search[0] != number:
+        board = Board.from_history(position, keys)
+        _worker_search = number, SharedSearch(board, worker_table(), _worker_current)
+        _worker_search[1].reset()
+    search = _worker_search[1]
+    search.tt.age = age
+    search.iteration = iteration
+    search.worker = worker
+    search.stopped = False
+    search.deadline = None if deadline is None else time.perf_counter() + max(0.0, deadline - time.time())
+
+    nodes = search.nodes
+    score = search.negamax(depth, -INFINITY, INFINITY, 0)
+    return depth, score, [move.move_id for move in search.pv[0]], search.nodes - nodes, search.stopped
+
+
+def moves_from_ids(board, move_ids):
+    # Turns a line of move ids into Move objects by replaying it on the board
+    moves = []
+    for move_id in move_ids:
+        move = board.get_valid_move_ids().get(move_id)
+        if move is None:
+            break
+        board.make_move(move)
+        moves.append(move)
+    for _ in moves:
+        board.undo_move()
+    return moves
+
+
+class ParallelSearch:
+    # Searches with a pool of worker processes sharing one transposition
+    # table, both reused between searches
+    def __init__(self, workers=None, tt_megabytes=16):
+        self.workers = workers or os.cpu_count() or 1
+        self.current = mp.Value('q', 0)
+        self.number = 0
+        self.age = 0
+        table = mp.RawArray('Q', table_words(tt_megabytes))
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                        initargs=(table, tt_megabytes, self.current))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.current.value += 1
+        self.pool.shutdown(cancel_futures=True)
+
+    def search(self, board, max_depth=64, max_time=None, info=None):
+        # Same interface and result as Search.search: returns (best move,
+        # score, principal variation), and calls info after every iteration
+        # with (depth, score, nodes, seconds, pv)
+        start = time.perf_counter()
+        deadline = time.time() + max_time if max_time is not None else None
+
+        moves = board.get_valid_moves()
+        if not moves:
+            return None, -MATE if board.checkmate else DRAW, []
+
+        self.number += 1
+        self.age = (self.age + 1) & 63
+        position = board.encode()
+        keys = board.encode_keys()
+        best_score, best_pv = 0, [moves[0].move_id]
+        nodes = 0
+
+        depth = 1
+        while depth <= max_depth:
+            self.current.value += 1
+            iteration = self.current.value
+            # Half the workers search a ply deeper, and the workers at each
+            # depth start on different root moves
+            pending = {self.pool.submit(_search_depth, (self.number, position, keys, depth + worker % 2, worker,
+                                                        iteration, self.age, deadline))
+                       for worker in range(self.workers)}
+
+            # The first search to finish ends the iteration, the deepest one
+            # if several finish together
+            result = None
+            while pending and result is None:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    searched = future.result()
+                    nodes += searched[3]
+                    if not searched[4] and (result is None or searched[0] > result[0]):
+                        result = searched
+            self.current.value += 1
+            for future in pending:
+                nodes += future.result()[3]
+
+            if result is None:
+                # Out of time part way through, keep the last full iteration
+                break
+            depth, best_score = result[0], result[1]
+            best_pv = result[2] or best_pv
+
+            elapsed = time.perf_counter() - start
+            if info is not None:
+                info(depth, best_score, nodes, elapsed, moves_from_ids(board, best_pv))
+
+            if abs(best_score) > MATE_BOUND:
+                break
+            if deadline is not None and time.time() + elapsed > deadline:
+                break
+            depth += 1
+
+        pv = moves_from_ids(board, best_pv)
+        return pv[0], best_score, pv
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel search from a position")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--depth", type=int, default=64)
+    parser.add_argument("--time", type=float, default=10.0, help="seconds to search")
+    parser.add_argument("--moves", nargs="*", default=[],
+                        help="long-notation moves played from the starting position")
+    args = parser.parse_args()
+
+    board = Board()
+    for notation in args.moves:
+        board.make_move(board.parse_move(notation))
+
+    def info(depth, score, nodes, seconds, pv):
+        print("depth %d  score %d  nodes %d  time %.2fs  nps %d  pv %s" % (
+            depth, score, nodes, seconds, nodes / seconds if seconds else 0,
+            " ".join(move.get_long_notation() for move in pv)))
+
+    with ParallelSearch(args.workers) as search:
+        move, score, pv = search.search(board, args.depth, args.time, info)
+    print("bestmove %s" % move.get_long_notation())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Perft: counts the leaf nodes of the move tree to a given depth
+
+Used both to check move generation against known node counts and to
+benchmark get_valid_moves / make_move / undo_move.
+
+    python3 perft.py 4
+    python3 perft.py 3 --divide --moves b1c1 j1k1
+    python3 perft.py --check
+"""
+
+import argparse
+import sys
+import time
+
+from board import Board
+from profiling import enable_from_environment
+
+# Reference positions given as a FEN (None for the starting position) and a
+# list of moves from it, with the number of legal leaf nodes at each depth
+REFERENCE_POSITIONS = [
+    ("start", None, [], {1: 20, 2: 400, 3: 8584, 4: 184025}),
+    ("check", None, ["p3n2", "g3f3", "o1m1", "g1f1", "a3c4", "h2g3", "b3c3", "g4f4", "p1o1", "j2k2",
+               "b1c1", "i1l4", "n2l3", "j4k4", "c4d2", "h3j2", "l3j2", "h1i1", "d2b3", "h4g4",
+               "c3d3", "f3e3", "b3d2", "j3k3", "a2b1", "k3l3", "o1l4", "g4h4", "j2i4"],
+     {1: 1, 2: 40, 3: 837, 4: 33058}),
+    ("pin", None, ["o2n2", "g3f3", "o1n1", "h2f4", "o4n4", "j1k1", "n4m4", "f4d2", "n1m1", "i1j1",
+             "a3c2", "d2c3", "c2e3", "j2l2", "e3g2", "j3k3", "g2e3", "j1m4", "p3n4", "i3j1",
+             "e3c4", "h1h2", "o3n3", "m4m3"],
+     {1: 26, 2: 964, 3: 26459, 4: 976625}),
+    ("middlegame", None, ["b1d1", "j1l1", "p3n2", "g2f2", "b3c3", "i2j1", "b4c4", "j2l2", "n2m4", "f2e2",
+                    "a2p3", "g4e4", "b2c2", "g3e3", "a1b2", "i3k4", "c3d3", "i1j2"],
+     {1: 32, 2: 1238, 3: 38593, 4: 1467967}),
+    ("promotion", "11k4/1p5n6p1/R5P9/K8P6 w 0 1", [], {1: 31, 2: 554, 3: 13970, 4: 250650}),
+    # A rook alone on an open ring reaches each of its 15 squares once, going
+    # either way round
+    ("open-ring", "16/16/R15/K9k5 w 0 1", [], {1: 21, 2: 49, 3: 1059, 4: 3273}),
+]
+
+
+def perft(board, depth, legal=True):
+    # Counts the leaf nodes depth plies below the current position
+    if depth == 0:
+        return 1
+    moves = board.get_valid_moves() if legal else board.get_all_moves()
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        board.make_move(move)
+        nodes += perft(board, depth - 1, legal)
+        board.undo_move()
+    return nodes
+
+
+def divide(board, depth, legal=True):
+    # Gets the perft count below each root move as a list of (move, nodes)
+    moves = board.get_valid_moves() if legal else board.get_all_moves()
+    results = []
+    for move in moves:
+        board.make_move(move)
+        results.append((move, perft(board, depth - 1, legal)))
+        board.undo_move()
+    return results
+
+
+def setup_board(moves, fen=None):
+    # Plays a list of long-notation moves from the FEN, or the starting position
+    board = Board.from_fen(fen) if fen else Board()
+    for notation in moves:
+        board.make_move(board.parse_move(notation))
+    return board
+
+
+def check(max_depth=None):
+    # Runs the reference positions, returns True if every count matches
+    passed = True
+    for name, fen, moves, expected in REFERENCE_POSITIONS:
+        board = setup_board(moves, fen)
+        for depth, count in sorted(expected.items()):
+            if max_depth is not None and depth > max_depth:
+                break
+            start = time.perf_counter()
+            nodes = perft(board, depth)
+            elapsed = time.perf_counter() - start
+            status = "ok" if nodes == count else "FAIL (expected %d)" % count
+            print("%-12s depth %d  %10d nodes  %8.2fs  %s" % (name, depth, nodes, elapsed, status))
+            passed = passed and nodes == count
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft for circular chess")
+    parser.add_argument("depth", type=int, nargs="?", default=4)
+    parser.add_argument("--fen", help="position to start from instead of the starting position")
+    parser.add_argument("--moves", nargs="*", default=[],
+                        help="long-notation moves played from the starting position or --fen")
+    parser.add_argument("--divide", action="store_true", help="print the count below each root move")
+    parser.add_argument("--pseudo", action="store_true", help="count pseudo-legal moves (get_all_moves)")
+    parser.add_argument("--check", action="store_true",
+                        help="verify the reference positions up to the given depth")
+    args = parser.parse_args()
+    enable_from_environment()
+
+    if args.check:
+        sys.exit(0 if check(args.depth) else 1)
+
+    board = setup_board(args.moves, args.fen)
+    legal = not args.pseudo
+
+    if args.divide:
+        start = time.perf_counter()
+        results = divide(board, args.depth, legal)
+        elapsed = time.perf_counter() - start
+        for move, nodes in sorted(results, key=lambda result: result[0].get_long_notation()):
+            print("%s: %d" % (move.get_long_notation(), nodes))
+        nodes = sum(count for _, count in results)
+        print("\nMoves: %d" % len(results))
+        print("Nodes: %d  Time: %.2fs  NPS: %d" % (nodes, elapsed, nodes / elapsed if elapsed else 0))
+        return
+
+    for depth in range(1, args.depth + 1):
+        start = time.perf_counter()
+        nodes = perft(board, depth, legal)
+        elapsed = time.perf_counter() - start
+        print("depth %d  nodes %d  time %.2fs  nps %d" % (depth, nodes, elapsed, nodes / elapsed if elapsed else 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Game records in a PGN-like text format
+
+A record is a block of [Tag "value"] header lines, a blank line, then the
+moves in long notation (Move.get_long_notation) with move numbers, ending
+with the result:
+
+    [Event "Casual game"]
+    [White "Alice"]
+    [Black "Bob"]
+    [Result "1-0"]
+
+    1. b1c1 j1k1 2. c1d1 ... 1-0
+
+A {comment} after a move is kept with the move it follows (Game.comments).
+A game that does not start from the standard position has a [FEN "..."]
+header in the format of Board.to_fen. Files hold any number of games one
+after another. read_games yields them one at a time while reading the file
+line by line, from any byte offset it gave for an earlier game, and
+write_game appends a game to the end of a file, so memory use does not grow
+with the size of the archive.
+
+    for game in read_games("games.pgn"):
+        board = game.replay()
+"""
+
+import re
+
+from board import Board
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+# Header tags written first and in this order, as in PGN
+STANDARD_TAGS = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+
+_HEADER = re.compile(r'\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]')
+_TOKENS = re.compile(r'\{[^}]*\}?|;.*|\d+\.+|[^\s{;]+')
+_LINE_LENGTH = 80
+
+
+class Game:
+    # One game record: headers, moves in long notation, the result, and
+    # comments keyed by the index of the move they follow
+    def __init__(self, headers=None, moves=None, result="*", comments=None):
+        self.headers = dict(headers) if headers else {}
+        self.moves = list(moves) if moves else []
+        self.result = result
+        self.comments = dict(comments) if comments else {}
+
+    @classmethod
+    def from_board(cls, board, headers=None):
+        # Records the moves played on a board, with the result worked out
+        # from the final position unless given in headers
+        game = cls(headers, [move.get_long_notation() for move in board.move_log])
+        game.result = game.headers.get("Result") or board_result(board)
+        return game
+
+    def start_board(self):
+        # A new board set up at the start of the game
+        fen = self.headers.get("FEN")
+        return Board.from_fen(fen) if fen else Board()
+
+    def play(self, board=None):
+        # Yields every move of the game as a Move on the board, just before it
+        # is made with make_move, so the board shows the position the move
+        # was played in. Moves leaving the king in check are accepted, since
+        # the snaffling rule allows them. Raises ValueError at the first move
+        # the piece cannot make
+        if board is None:
+            board = self.start_board()
+        for ply, notation in enumerate(self.moves):
+            try:
+                move = board.parse_move(notation, legal=False)
+            except ValueError:
+                raise ValueError("Illegal move %s at ply %d of %s" % (notation, ply + 1, self.describe()))
+            yield move
+            board.make_move(move)
+
+    def replay(self, board=None):
+        # Plays all the moves and returns the board at the end of the game
+        if board is None:
+            board = self.start_board()
+        for _ in self.play(board):
+            pass
+        return board
+
+    def describe(self):
+        # Short description for error messages
+        return "%s - %s (%s)" % (self.headers.get("White", "?"), self.headers.get("Black", "?"),
+                                 self.headers.get("Date", "?"))
+
+    def format(self):
+        # The text of the record, ending with a blank line
+        headers = dict(self.headers)
+        headers["Result"] = self.result
+        tags = [tag for tag in STANDARD_TAGS if tag in headers]
+        tags += [tag for tag in headers if tag not in STANDARD_TAGS]
+        lines = ['[%s "%s"]' % (tag, str(headers[tag]).replace('\\', '\\\\').replace('"', '\\"'))
+                 for tag in tags]
+        lines.append("")
+
+        # Move numbers follow the fullmove number of the starting position
+        fen = self.headers.get("FEN")
+        number, white = 1, True
+        if fen:
+            fields = fen.split()
+            white = fields[1] == 'w'
+            number = int(fields[3]) if len(fields) > 3 else 1
+
+        # A move number stays on the same line as its move. Black's move
+        # gets its number too when it starts the game or follows a comment
+        tokens = []
+        for ply, notation in enumerate(self.moves):
+            if white:
+                tokens.append("%d. %s" % (number, notation))
+            else:
+                tokens.append(notation if tokens and ply - 1 not in self.comments else
+                              "%d... %s" % (number, notation))
+                number += 1
+            white = not white
+            if ply in self.comments:
+                tokens.append("{%s}" % self.comments[ply].replace('}', ')'))
+        tokens.append(self.result)
+
+        line = ""
+        for token in tokens:
+            if line and len(line) + 1 + len(token) > _LINE_LENGTH:
+                lines.append(line)
+                line = token
+            else:
+                line = line + " " + token if line else token
+        lines.append(line)
+        return "\n".join(lines) + "\n\n"
+
+
+def board_result(board):
+    # The result of the game on the board: a win for the side that gave
+    # checkmate, a draw on stalemate, otherwise "*" for unfinished
+    board.get_valid_moves()
+    if board.checkmate:
+        return "0-1" if board.white_to_move else "1-0"
+    if board.stalemate:
+        return "1/2-1/2"
+    return "*"
+
+
+def parse_games(lines):
+    # Yields a Game for every record in an iterable of lines. Only the game
+    # being read is kept in memory
+    headers, moves, result, comments = {}, [], None, {}
+    in_moves = in_comment = False
+    # Lines of the {comment} being read
+    comment = []
+
+    for line in lines:
+        line = line.strip()
+
+        if in_comment:
+            # The rest of a {comment} that spans several lines
+            if '}' not in line:
+                comment.append(line)
+                continue
+            comment.append(line[:line.index('}')])
+            if moves:
+                comments[len(moves) - 1] = " ".join(comment).strip()
+            line = line[line.index('}') + 1:]
+            in_comment = False
+
+        if line.startswith('['):
+            if in_moves:
+                # Headers of the next game without a result before them
+                yield Game(headers, moves, "*", comments)
+                headers, moves, comments, in_moves = {}, [], {}, False
+            match = _HEADER.match(line)
+            if match:
+                headers[match.group(1)] = re.sub(r'\\(.)', r'\1', match.group(2))
+            continue
+
+        for token in _TOKENS.findall(line):
+            if token[0] == '{':
+                in_comment = not token.endswith('}')
+                if in_comment:
+                    comment = [token[1:]]
+                elif moves:
+                    comments[len(moves) - 1] = token[1:-1].strip()
+            elif token[0] == ';' or token[0].isdigit() and token.endswith('.'):
+                continue
+            elif token in RESULTS:
+                result = token
+            else:
+                moves.append(token)
+            in_moves = True
+
+            if result is not None:
+                yield Game(headers, moves, result, comments)
+                headers, moves, result, comments = {}, [], None, {}
+                in_moves = False
+
+    if in_moves or headers:
+        yield Game(headers, moves, "*", comments)
+
+
+def read_games(path, offset=0, offsets=False):
+    # Yields the games of a file one at a time, see parse_games, reading from
+    # a byte offset. With offsets it yields (game, offset) pairs instead, the
+    # offset being where to carry on reading after that game
+    with open(path, "rb") as file:
+        file.seek(offset)
+        # Start and end of the line being parsed, and whether it is a header
+        line_at = [offset, offset, False]
+
+        def lines():
+            for line in file:
+                line_at[:] = [line_at[1], line_at[1] + len(line), line.lstrip().startswith(b'[')]
+                yield line.decode()
+            line_at[:] = [line_at[1], line_at[1], False]
+
+        for game in parse_games(lines()):
+            if offsets:
+                # A game ended by the headers of the next one ends before them
+                yield game, line_at[0] if line_at[2] else line_at[1]
+            else:
+                yield game
+
+
+def write_game(path, game):
+    # Appends a game to a file, creating it if needed
+    with open(path, "a") as file:
+        file.write(game.format())
+
+
+def write_games(path, games):
+    # Appends many games, keeping the file open between them
+    with open(path, "a") as file:
+        for game in games:
+            file.write(game.format())
@@ -0,0 +1,220 @@
+"""
+Opt-in profiling of move generation, searching and drawing
+
+enable() wraps the hot methods of Board, Search and BoardRenderer with
+counting and timing versions, and disable() puts the originals back. While
+profiling is off nothing is wrapped, so it costs nothing. Collected:
+
+    calls and nanoseconds   get_valid_moves, get_all_moves, the move
+                            generation of each piece, make_move, undo_move,
+                            draw_board, draw_pieces, draw_squares
+    moves                   moves generated per piece type
+    searches                nodes and nanoseconds, for nodes per second
+    frames                  histogram of frame times, from record_frame
+
+Setting CIRCULAR_CHESS_PROFILE to a file name profiles main.py, engine.py,
+perft.py, selfplay.py and server.py: the results are written to that file
+as JSON and a summary table is printed when the program exits. Worker
+processes are not profiled.
+
+    CIRCULAR_CHESS_PROFILE=profile.json python3 perft.py 4
+    python3 profiling.py profile.json            # summary of a saved profile
+"""
+
+import atexit
+import json
+import os
+import sys
+import time
+from functools import wraps
+
+ENVIRONMENT_VARIABLE = "CIRCULAR_CHESS_PROFILE"
+
+# Upper bounds of the frame time histogram buckets, in milliseconds
+FRAME_BUCKETS = (1, 2, 4, 8, 16, 33, 66)
+
+# Board methods that generate the moves of one piece type
+PIECE_METHODS = {'p': "get_pawn_moves", 'N': "get_knight_moves", 'B': "get_bishop_moves",
+                 'R': "get_rook_moves", 'Q': "get_queen_moves", 'K': "get_king_moves"}
+
+enabled = False
+
+calls = {}
+nanoseconds = {}
+moves = {}
+searches = {"count": 0, "nodes": 0, "nanoseconds": 0}
+frames = [0] * (len(FRAME_BUCKETS) + 1)
+
+# (class, method name, original function) of every wrapped method
+_originals = []
+
+
+def reset():
+    # Clears everything collected so far
+    calls.clear()
+    nanoseconds.clear()
+    moves.clear()
+    searches.update(count=0, nodes=0, nanoseconds=0)
+    frames[:] = [0] * len(frames)
+
+
+def _record(name, elapsed):
+    calls[name] = calls.get(name, 0) + 1
+    nanoseconds[name] = nanoseconds.get(name, 0) + elapsed
+
+
+def _timed(name, function):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _record(name, time.perf_counter_ns() - start)
+    return wrapper
+
+
+def _piece_timed(name, piece, function):
+    # Times a move generation method and counts the moves it adds to the
+    # list passed as its moves argument
+    @wraps(function)
+    def wrapper(self, *args, **kwargs):
+        move_list = args[-1] if piece != 'p' else args[0]
+        before = len(move_list)
+        start = time.perf_counter_ns()
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            _record(name, time.perf_counter_ns() - start)
+            moves[piece] = moves.get(piece, 0) + len(move_list) - before
+    return wrapper
+
+
+def _search_timed(function):
+    # Counts the nodes and time of each Search.iterate call
+    @wraps(function)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter_ns()
+        nodes = self.nodes
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            searches["count"] += 1
+            searches["nodes"] += self.nodes - nodes
+            searches["nanoseconds"] += time.perf_counter_ns() - start
+    return wrapper
+
+
+def _wrap(cls, name, wrapper):
+    _originals.append((cls, name, cls.__dict__[name]))
+    setattr(cls, name, wrapper)
+
+
+def enable(rendering=False):
+    # Starts profiling. Boards created before this keep unwrapped piece move
+    # generation. rendering also wraps BoardRenderer, which imports pygame
+    global enabled
+    if enabled:
+        return
+    from board import Board
+    from search import Search
+
+    for name in ("get_valid_moves", "get_all_moves", "make_move", "undo_move"):
+        _wrap(Board, name, _timed(name, getattr(Board, name)))
+    for piece, name in PIECE_METHODS.items():
+        _wrap(Board, name, _piece_timed(name, piece, getattr(Board, name)))
+    _wrap(Search, "iterate", _search_timed(Search.iterate))
+
+    if rendering:
+        from render import BoardRenderer
+        for name in ("draw_board", "draw_pieces", "draw_squares"):
+            _wrap(BoardRenderer, name, _timed(name, getattr(BoardRenderer, name)))
+    enabled = True
+
+
+def disable():
+    # Stops profiling, keeping what was collected
+    global enabled
+    while _originals:
+        cls, name, function = _originals.pop()
+        setattr(cls, name, function)
+    enabled = False
+
+
+def record_frame(seconds):
+    # Adds a frame time to the histogram. Callers check enabled first
+    milliseconds = seconds * 1000
+    for i, bound in enumerate(FRAME_BUCKETS):
+        if milliseconds < bound:
+            frames[i] += 1
+            return
+    frames[-1] += 1
+
+
+def report():
+    # Everything collected, as a dict that can be written as JSON
+    return {
+        "phases": {name: {"calls": calls[name], "nanoseconds": nanoseconds[name],
+                          "nanoseconds_per_call": nanoseconds[name] // calls[name]}
+                   for name in sorted(calls)},
+        "moves": dict(moves),
+        "searches": dict(searches, nodes_per_second=searches["nodes"] * 10**9 // searches["nanoseconds"]
+                         if searches["nanoseconds"] else 0),
+        "frames": {"buckets_ms": list(FRAME_BUCKETS), "counts": list(frames)},
+    }
+
+
+def summary(data=None):
+    # Formats a report (the current one by default) as a table
+    if data is None:
+        data = report()
+    lines = ["%-18s %12s %12s %12s" % ("phase", "calls", "total ms", "ns/call")]
+    for name, phase in sorted(data["phases"].items(), key=lambda item: -item[1]["nanoseconds"]):
+        lines.append("%-18s %12d %12.1f %12d" % (name, phase["calls"], phase["nanoseconds"] / 1e6,
+                                                 phase["nanoseconds_per_call"]))
+    if data["moves"]:
+        lines.append("moves generated    " + "  ".join("%s %d" % (piece, data["moves"][piece])
+                                                        for piece in PIECE_METHODS if piece in data["moves"]))
+    search_data = data["searches"]
+    if search_data["count"]:
+        lines.append("searches %d  nodes %d  nodes/s %d" % (search_data["count"], search_data["nodes"],
+                                                           search_data["nodes_per_second"]))
+    counts = data["frames"]["counts"]
+    if any(counts):
+        bounds = data["frames"]["buckets_ms"]
+        labels = ["<%dms" % bound for bound in bounds] + [">=%dms" % bounds[-1]]
+        lines.append("frames             " + "  ".join("%s %d" % (label, count)
+                                                        for label, count in zip(labels, counts) if count))
+    return "\n".join(lines)
+
+
+def write(path):
+    with open(path, "w") as file:
+        json.dump(report(), file, indent=2)
+
+
+def enable_from_environment(rendering=False):
+    # Profiles the program when CIRCULAR_CHESS_PROFILE is set, writing the
+    # report there and printing the summary on exit
+    path = os.environ.get(ENVIRONMENT_VARIABLE)
+    if not path:
+        return
+    enable(rendering)
+
+    def finish():
+        write(path)
+        print(summary(), file=sys.stderr)
+
+    atexit.register(finish)
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("usage: python3 profiling.py profile.json", file=sys.stderr)
+        sys.exit(2)
+    with open(sys.argv[1]) as file:
+        print(summary(json.load(file)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Drawing of the circular board and its pieces with pygame
+
+Kept apart from board.py so the rules engine can be imported without
+pygame or numpy. Board.draw imports this module the first time it is used.
+"""
+
+import numpy as np
+import pygame as pg
+import pygame.gfxdraw
+from constants import *
+
+
+def piece_rect(a, sect):
+    # Where the image of a piece on the given square is drawn
+    r = (MIDDLE_RADIUS + SPACING * a) * SCALING
+    theta = SLICE / 2 + SLICE * sect
+    x = CENTER[0] + r * np.cos(pi - theta) - PIECE_SIZE / 2
+    y = CENTER[1] - r * np.sin(pi - theta) - PIECE_SIZE / 2
+    return pg.Rect(x, y, PIECE_SIZE, PIECE_SIZE)
+
+
+# Piece image rectangle of every square, indexed [annulus][sector]
+PIECE_RECTS = [[piece_rect(a, sect) for sect in range(SECTORS)] for a in range(ANNULI)]
+
+
+class BoardRenderer:
+    # Draws a 4x16 board, caching the rendered squares between frames
+    def __init__(self):
+        # Square colors and the board surface drawn with them
+        self.theme = (LIGHT, DARK)
+        self.board_surface = None
+        self.board_surface_key = None
+
+    def fill_arc(self, window, center, radius, theta0, theta1, color, ndiv=150):
+        # Fills an arc in the window to represent a circular sector
+        x0, y0 = center
+
+        dtheta = (theta1 - theta0) / ndiv
+        angles = [theta0 + i*dtheta for i in range(ndiv + 1)]
+
+        points = [(x0, y0)] + [(x0 + radius * np.cos(theta), y0 -
+                                radius * np.sin(theta)) for theta in angles]
+
+        pygame.gfxdraw.filled_polygon(window, points, color)
+
+    def get_board_surface(self, window):
+        # The board never changes during a game, so it is rendered once and
+        # the cached surface is reused until the window size or theme changes
+        cache_key = (window.get_size(), self.theme)
+        if self.board_surface is None or self.board_surface_key != cache_key:
+            self.board_surface = self.render_board(window)
+            self.board_surface_key = cache_key
+        return self.board_surface
+
+    def draw_board(self, window):
+        # Draws the circular chess board
+        window.blit(self.get_board_surface(window), (0, 0))
+
+    def render_board(self, window):
+        # Renders the squares onto a new surface matching the window
+        surface = pg.Surface(window.get_size()).convert(window)
+        surface.fill(GRAY)
+
+        light, dark = self.theme
+        for ring in range(ANNULI):
+            radius = WIDTH//2 - ring*SPACING
+            for sector in range(SECTORS):
+                color = dark if ((sector+ring) % 2) else light
+
+                self.fill_arc(surface, CENTER, radius, sector *
+                              SLICE, (sector+1)*SLICE, color)
+
+        pg.draw.circle(surface, GRAY, CENTER, MIDDLE_RADIUS)
+        return surface
+
+    def draw_pieces(self, window, board, images, area=None):
+        # Draws the chess pieces on the circular chess board, or only the
+        # pieces overlapping area when it is given
+        for a in range(ANNULI):
+            for sect in range(SECTORS):
+                piece = board[a][sect]
+                if piece != "--":
+                    rect = PIECE_RECTS[a][sect]
+                    if area is None or rect.colliderect(area):
+                        window.blit(images[piece], rect)
+
+    def draw_highlights(self, window, highlights, hints=()):
+        # Circles the given (annulus, sector) squares, the selected ones in
+        # blue and those of the engine's suggested move in green
+        for a, sect in hints:
+            pg.draw.circle(window, GREEN, PIECE_RECTS[a][sect].center, PIECE_SIZE // 2 - 3, 2)
+        for a, sect in highlights:
+            pg.draw.circle(window, BLUE, PIECE_RECTS[a][sect].center, PIECE_SIZE // 2, 2)
+
+    def draw(self, window, board, images, highlights=(), hints=()):
+        # Combines the board and piece drawing
+        self.draw_board(window)
+        self.draw_pieces(window, board, images)
+        self.draw_highlights(window, highlights, hints)
+
+    def draw_squares(self, window, board, images, squares, highlights=(), hints=()):
+        # Redraws only the given (annulus, sector) squares and returns the
+        # rectangles that changed, for pg.display.update
+        surface = self.get_board_surface(window)
+        rects = []
+        for a, sect in squares:
+            rect = PIECE_RECTS[a][sect]
+            # Neighboring pieces can overlap the square, clipping keeps them intact
+            window.set_clip(rect)
+            window.blit(surface, rect, rect)
+            self.draw_pieces(window, board, images, rect)
+            self.draw_highlights(window, highlights, hints)
+            rects.append(rect)
+        window.set_clip(None)
+        return rects
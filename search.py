@@ -0,0 +1,309 @@
+"""
+Alpha-beta search for circular chess
+
+Negamax with iterative deepening, a transposition table and a quiescence
+search on captures. Moves are ordered by the transposition table move,
+MVV-LVA for captures, killer moves and the history heuristic.
+
+    search = Search(board)
+    move, score, pv = search.search(max_depth=6, max_time=5)
+"""
+
+import time
+from bisect import insort
+
+from evaluation import evaluate, PIECE_VALUES
+from tablebase import WIN, LOSS
+from zobrist import TranspositionTable, EXACT, LOWER, UPPER
+
+INFINITY = 1000000
+MATE = 100000
+# Scores beyond this are mates, counted in plies from the root
+MATE_BOUND = MATE - 1000
+DRAW = 0
+
+MAX_PLY = 128
+
+
+def score_to_tt(score, ply):
+    # Mate scores are stored relative to the node rather than the root
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class Search:
+    # Searches a board for the best move for the player to move. The board is
+    # searched in place with make_move/undo_move and left as it was found
+    def __init__(self, board, tt=None, tablebases=None):
+        self.board = board
+        self.tt = tt if tt is not None else TranspositionTable()
+        self.evaluate = evaluate
+        # Endgame tables (tablebase.Tablebases) that replace the search in
+        # positions with few enough pieces
+        self.tablebases = tablebases
+
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [0] * 4096
+        self.pv = [[] for _ in range(MAX_PLY + 1)]
+
+        self.nodes = 0
+        self.max_nodes = None
+        self.deadline = None
+        self.start_time = 0
+        self.stopped = False
+
+    def stop(self):
+        # Asks a running search to return as soon as possible
+        self.stopped = True
+
+    def search(self, max_depth=64, max_nodes=None, max_time=None, info=None):
+        # Iteratively deepens until max_depth, or until the node or time (in
+        # seconds) limit runs out. Returns (best move, score, principal
+        # variation) of the deepest completed iteration. info, if given, is
+        # called after every iteration with (depth, score, nodes, seconds, pv)
+        self.reset(max_nodes, max_time)
+        return self.iterate(max_depth, info)
+
+    def iterate(self, max_depth=64, info=None):
+        # The iterative deepening loop of search, for callers that have
+        # already called reset to set the limits and start the clock
+        self.tt.new_search()
+
+        best_move, best_score, best_pv = None, 0, []
+        moves = self.board.get_valid_moves()
+        if not moves:
+            return None, -MATE if self.board.checkmate else DRAW, []
+
+        for depth in range(1, min(max_depth, MAX_PLY - 1) + 1):
+            score = self.negamax(depth, -INFINITY, INFINITY, 0)
+            if self.stopped and best_move is not None:
+                break
+
+            best_pv = list(self.pv[0])
+            best_score = score
+            best_move = best_pv[0] if best_pv else moves[0]
+
+            elapsed = time.perf_counter() - self.start_time
+            if info is not None:
+                info(depth, best_score, self.nodes, elapsed, best_pv)
+
+            if self.stopped or abs(best_score) > MATE_BOUND:
+                break
+            # A new iteration takes longer than all the previous ones together
+            if self.deadline is not None and elapsed * 2 > self.deadline - self.start_time:
+                break
+
+        return best_move, best_score, best_pv
+
+    def best_moves(self, depth, count):
+        # Gets (score, Move) for the best count root moves searched to depth,
+        # best first. Each move only has to beat the count-th best score so
+        # far, so the others are cut off as soon as they are shown worse
+        board = self.board
+        entry = self.tt.probe(board.zobrist_key)
+        moves = board.get_valid_moves()
+        self.order_moves(moves, 0, entry[3] if entry is not None else 0)
+
+        # (-score, order searched, Move), kept sorted by bisect so the best
+        # is first. The order breaks ties before Moves would be compared
+        best = []
+        scored = set()
+        for order, move in enumerate(moves):
+            if move.move_id in scored:
+                continue
+            alpha = -best[-1][0] if len(best) == count else -INFINITY
+            board.make_move(move)
+            score = -self.negamax(depth - 1, -INFINITY, -alpha, 1)
+            board.undo_move()
+            if self.stopped:
+                break
+            scored.add(move.move_id)
+            if score > alpha:
+                insort(best, (-score, order, move))
+                del best[count:]
+        return [(-negated, move) for negated, _, move in best]
+
+    def reset(self, max_nodes=None, max_time=None):
+        # Clears the counters and move ordering tables and starts the clock
+        self.nodes = 0
+        self.max_nodes = max_nodes
+        self.start_time = time.perf_counter()
+        self.deadline = self.start_time + max_time if max_time is not None else None
+        self.stopped = False
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [0] * 4096
+
+    def check_limits(self):
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            self.stopped = True
+        elif self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.stopped = True
+
+    def negamax(self, depth, alpha, beta, ply):
+        board = self.board
+        self.pv[ply] = []
+
+        # Returning to an earlier position of the game or search is a draw
+        if ply and board.is_repetition():
+            return DRAW
+        if ply and self.tablebases is not None:
+            score = self.probe_tablebases(ply)
+            if score is not None:
+                return score
+        if depth <= 0 or ply >= MAX_PLY - 1:
+            return self.quiescence(alpha, beta, ply)
+
+        self.nodes += 1
+        if not self.nodes & 1023:
+            self.check_limits()
+        if self.stopped:
+            return 0
+
+        key = board.zobrist_key
+        tt_move = 0
+        entry = self.tt.probe(key)
+        if entry is not None:
+            tt_depth, flag, tt_score, tt_move = entry
+            if ply and tt_depth >= depth:
+                tt_score = score_from_tt(tt_score, ply)
+                if flag == EXACT or (flag == LOWER and tt_score >= beta) or \
+                        (flag == UPPER and tt_score <= alpha):
+                    return tt_score
+
+        moves = board.get_valid_moves()
+        if not moves:
+            return -MATE + ply if board.checkmate else DRAW
+        self.order_moves(moves, ply, tt_move)
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = moves[0]
+        for move in moves:
+            board.make_move(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            board.undo_move()
+            if self.stopped:
+                return 0
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if score >= beta:
+                        if move.piece_captured == "--" and not move.promotion:
+                            self.update_quiet_move(move, depth, ply)
+                        break
+
+        if best_score >= beta:
+            flag = LOWER
+        elif best_score > original_alpha:
+            flag = EXACT
+        else:
+            flag = UPPER
+        self.tt.store(key, depth, flag, score_to_tt(best_score, ply), best_move.move_id)
+        return best_score
+
+    def probe_tablebases(self, ply):
+        # Exact score of the position from the endgame tables, or None
+        if bin(self.board.position.occupied).count('1') > self.tablebases.max_pieces:
+            return None
+        entry = self.tablebases.probe(self.board)
+        if entry is None:
+            return None
+        result, plies = entry
+        if result == WIN:
+            return MATE - ply - plies
+        if result == LOSS:
+            return -MATE + ply + plies
+        return DRAW
+
+    def quiescence(self, alpha, beta, ply):
+        # Searches captures and promotions only, until the position is quiet
+        board = self.board
+        self.pv[ply] = []
+
+        self.nodes += 1
+        if not self.nodes & 1023:
+            self.check_limits()
+        if self.stopped:
+            return 0
+
+        moves = board.get_valid_moves()
+        if not moves:
+            return -MATE + ply if board.checkmate else DRAW
+
+        best_score = self.evaluate(board)
+        if best_score >= beta or ply >= MAX_PLY - 1:
+            return best_score
+        alpha = max(alpha, best_score)
+
+        captures = [move for move in moves if move.piece_captured != "--" or move.promotion]
+        captures.sort(key=mvv_lva, reverse=True)
+        for move in captures:
+            board.make_move(move)
+            score = -self.quiescence(-beta, -alpha, ply + 1)
+            board.undo_move()
+            if self.stopped:
+                return 0
+
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if score >= beta:
+                        break
+        return best_score
+
+    def order_moves(self, moves, ply, tt_move):
+        # Sorts moves best first: transposition table move, captures by
+        # MVV-LVA, killer moves, then quiet moves by history
+        killers = self.killers[ply]
+        history = self.history
+
+        def priority(move):
+            if move.move_id == tt_move:
+                return 3 * INFINITY
+            if move.piece_captured != "--" or move.promotion:
+                return 2 * INFINITY + mvv_lva(move)
+            if move == killers[0] or move == killers[1]:
+                return INFINITY
+            return history[move.move_id & 4095]
+
+        moves.sort(key=priority, reverse=True)
+
+    def update_quiet_move(self, move, depth, ply):
+        # A quiet move caused a beta cutoff: remember it as a killer at this
+        # ply and reward it in the history table
+        killers = self.killers[ply]
+        if move != killers[0]:
+            killers[1] = killers[0]
+            killers[0] = move
+        self.history[move.move_id & 4095] += depth * depth
+        if self.history[move.move_id & 4095] > INFINITY // 2:
+            # Keep history scores below the killer moves
+            self.history = [score // 2 for score in self.history]
+
+
+def mvv_lva(move):
+    # Most valuable victim first, then least valuable attacker. A promotion
+    # counts as capturing the material the pawn gains
+    score = -PIECE_VALUES[move.piece_moved[1]]
+    if move.piece_captured != "--":
+        score += 10 * PIECE_VALUES[move.piece_captured[1]]
+    if move.promotion:
+        score += 10 * (PIECE_VALUES[move.promotion[1]] - PIECE_VALUES['p'])
+    return score
@@ -0,0 +1,197 @@
+"""
+Headless self-play: plays many games between computer players on a pool of
+worker processes and writes them to a game record file as they finish
+
+Players are given as strings:
+
+    random      picks uniformly among the legal moves
+    reckless    picks uniformly among all moves, including ones that leave
+                its king in check, so it can lose by having its king snaffled
+    search:N    searches N plies deep with search.Search
+
+A game ends when a king is captured (snaffling: the side to move takes a
+king left in check), on checkmate or stalemate, when a position occurs for
+the third time, or after a maximum number of plies. Games are written in
+the format of pgn.py with a Termination header.
+
+    python3 selfplay.py --games 1000 --white random --black search:2 --output selfplay.pgn
+"""
+
+import argparse
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from board import Board
+from pgn import Game, write_games
+from profiling import enable_from_environment
+from search import Search
+from zobrist import init_worker_table, worker_table
+
+def make_player(spec):
+    # Turns a player string into a function of (board, rng) returning a move
+    if spec == "random":
+        return lambda board, rng: rng.choice(board.get_valid_moves())
+    if spec == "reckless":
+        return lambda board, rng: rng.choice(board.get_all_moves())
+    if spec.startswith("search:"):
+        depth = int(spec.split(":")[1])
+
+        def search_player(board, rng):
+            move, _, _ = Search(board, worker_table()).search(max_depth=depth)
+            return move
+        return search_player
+    raise ValueError("Unknown player: " + spec)
+
+
+def king_capture(board):
+    # The move taking the opponent's king, if it was left in check
+    enemy_king = board.position.pieces[('b' if board.white_to_move else 'w') + 'K']
+    if not enemy_king:
+        return None
+    own_color = 'w' if board.white_to_move else 'b'
+    if not board.is_attacked(enemy_king.bit_length() - 1, own_color, board.position.occupied):
+        return None
+    for move in board.get_all_moves():
+        if move.piece_captured[1] == 'K':
+            return move
+    return None
+
+
+def play_game(white, black, max_plies=400, seed=None):
+    # Plays one game between two player strings. Returns (Game, termination)
+    rng = random.Random(seed)
+    players = (make_player(white), make_player(black))
+    board = Board()
+    win = ("1-0", "0-1")
+
+    while True:
+        side = 0 if board.white_to_move else 1
+        snaffle = king_capture(board)
+        if snaffle is not None:
+            board.make_move(snaffle)
+            result, termination = win[side], "king captured"
+            break
+        if not board.get_valid_moves():
+            if board.checkmate:
+                result, termination = win[1 - side], "checkmate"
+            else:
+                result, termination = "1/2-1/2", "stalemate"
+            break
+        if board.repetition_count() >= 3:
+            result, termination = "1/2-1/2", "repetition"
+            break
+        if len(board.move_log) >= max_plies:
+            result, termination = "1/2-1/2", "move cap"
+            break
+        board.make_move(players[side](board, rng))
+
+    game = Game.from_board(board, {"Event": "Self-play", "White": white, "Black": black,
+                                   "Result": result, "Termination": termination})
+    return game, termination
+
+
+def _play_task(task):
+    # Runs in a worker process. Returns (round, Game, worker pid, seconds busy)
+    number, white, black, max_plies, seed = task
+    start = time.perf_counter()
+    game, _ = play_game(white, black, max_plies, seed)
+    game.headers["Round"] = str(number)
+    return number, game, os.getpid(), time.perf_counter() - start
+
+
+class SelfPlayStats:
+    # Counts games, moves and the time each worker spent playing
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.games = 0
+        self.moves = 0
+        self.results = Counter()
+        self.terminations = Counter()
+        self.worker_games = Counter()
+        self.worker_busy = Counter()
+
+    def add(self, game, pid, seconds):
+        self.games += 1
+        self.moves += len(game.moves)
+        self.results[game.result] += 1
+        self.terminations[game.headers.get("Termination", "?")] += 1
+        self.worker_games[pid] += 1
+        self.worker_busy[pid] += seconds
+
+    def report(self):
+        # Lines summarizing throughput, results and worker utilization
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        lines = ["games %d  moves %d  time %.1fs  games/s %.1f  moves/s %.0f" % (
+                     self.games, self.moves, elapsed, self.games / elapsed, self.moves / elapsed),
+                 "results " + "  ".join("%s %d" % item for item in sorted(self.results.items())),
+                 "endings " + "  ".join("%s %d" % item for item in sorted(self.terminations.items()))]
+        for pid in sorted(self.worker_games):
+            lines.append("worker %d  games %d  busy %.1fs  utilization %.0f%%" % (
+                pid, self.worker_games[pid], self.worker_busy[pid], 100 * self.worker_busy[pid] / elapsed))
+        return lines
+
+
+def self_play(games, white="random", black="random", workers=None, max_plies=400, seed=0,
+              tt_megabytes=4, stats=None, progress=None):
+    # Yields the games as they finish, playing them on a pool of worker
+    # processes. Only a few games per worker are queued at a time, so any
+    # number of games can be generated. progress, if given, is called after
+    # every game with the stats
+    workers = workers or os.cpu_count() or 1
+    stats = stats if stats is not None else SelfPlayStats()
+    tasks = ((number, white, black, max_plies, seed * 1000003 + number) for number in range(1, games + 1))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker_table,
+                             initargs=(tt_megabytes,)) as pool:
+        pending = set()
+        for task in tasks:
+            pending.add(pool.submit(_play_task, task))
+            if len(pending) < workers * 4:
+                continue
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                number, game, pid, seconds = future.result()
+                stats.add(game, pid, seconds)
+                if progress is not None:
+                    progress(stats)
+                yield game
+        for future in pending:
+            number, game, pid, seconds = future.result()
+            stats.add(game, pid, seconds)
+            if progress is not None:
+                progress(stats)
+            yield game
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Self-play games between computer players")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--white", default="random", help="random, reckless or search:N")
+    parser.add_argument("--black", default="random", help="random, reckless or search:N")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--max-plies", type=int, default=400, help="plies before a game is drawn")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="selfplay.pgn", help="game record file to append to")
+    parser.add_argument("--progress", type=int, default=0, help="print the stats every N games")
+    args = parser.parse_args()
+    enable_from_environment()
+
+    # Bad player strings are reported before any process starts
+    make_player(args.white)
+    make_player(args.black)
+
+    def progress(stats):
+        if args.progress and stats.games % args.progress == 0:
+            print(stats.report()[0], flush=True)
+
+    stats = SelfPlayStats()
+    write_games(args.output, self_play(args.games, args.white, args.black, args.workers,
+                                       args.max_plies, args.seed, stats=stats, progress=progress))
+    print("\n".join(stats.report()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+Game server: hosts many games at once over a line protocol on TCP
+
+Each game is a Board. Players and spectators connect with any line-based
+client (e.g. nc localhost 8765) and send commands, one per line:
+
+    create [white|black] [engine N]   -> created <id> <color>
+    join <id>                         -> joined <id> <color>, then start <id> to both players
+    watch <id>                        -> watching <id> <fen>
+    move <id> <move>                  -> moved <id> <move> <fen> to players and spectators
+    moves <id>                        -> moves <id> <legal moves ...>
+    resign <id>
+    list                              -> games <id ...> of games waiting for a player
+    stats                             -> stats games N clients N memory ... latency ...
+    quit
+
+Moves use long notation (Move.get_long_notation) and are checked against
+the legal moves of the player to move. When a game ends everyone in it gets
+"over <id> <result> <reason>". With "engine N" the other side is played by
+an N-ply search (at most MAX_ENGINE_DEPTH plies and ENGINE_TIME seconds),
+which runs in a pool of worker processes so the event loop never waits for
+it. Errors are answered with "error <message>".
+
+    python3 server.py --port 8765
+    python3 server.py --bench 1000        # local clients playing 1000 random games
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from board import Board, Move
+from profiling import enable_from_environment
+from search import Search
+from zobrist import init_worker_table, worker_table
+
+# Deepest search a client can ask the engine for, and the seconds it may
+# think per move, so one game cannot hold a pool worker for long
+MAX_ENGINE_DEPTH = 6
+ENGINE_TIME = 5.0
+
+def _engine_move(task):
+    # Runs in a worker process: searches the position and returns the move id
+    position, keys, depth = task
+    board = Board.from_history(position, keys)
+    move, _, _ = Search(board, worker_table()).search(max_depth=depth, max_time=ENGINE_TIME)
+    return move.move_id if move is not None else None
+
+
+def deep_size(obj, seen=None):
+    # Bytes used by an object and the lists, dicts, tuples and game objects
+    # it holds. Other objects (strings, bound methods, ...) count by their
+    # own size only
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple, set)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, Move):
+        size += sum(deep_size(getattr(obj, name), seen) for name in Move.__slots__)
+    elif hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    return size
+
+
+class Latencies:
+    # Keeps the most recent latencies, in seconds, for percentiles
+    def __init__(self, size=10000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self):
+        if not self.samples:
+            return "n 0"
+        samples = sorted(self.samples)
+        return "n %d p50 %.2fms p99 %.2fms max %.2fms" % (
+            self.count, 1000 * samples[len(samples) // 2], 1000 * samples[len(samples) * 99 // 100],
+            1000 * samples[-1])
+
+
+class Game:
+    # A board with its players, spectators and result
+    def __init__(self, game_id, engine=None, engine_depth=0):
+        self.id = game_id
+        self.board = Board()
+        self.players = {'w': None, 'b': None}
+        self.spectators = set()
+        self.engine = engine
+        self.engine_depth = engine_depth
+        self.result = None
+
+    def color_to_move(self):
+        return 'w' if self.board.white_to_move else 'b'
+
+    def seated(self):
+        # Whether both sides are played, by a client or the engine
+        return all(player is not None or color == self.engine for color, player in self.players.items())
+
+    def clients(self):
+        return [client for client in self.players.values() if client is not None] + list(self.spectators)
+
+
+class Client:
+    # One connection, and the games it plays or watches
+    def __init__(self, writer):
+        self.writer = writer
+        self.games = set()
+
+    def send(self, line):
+        # Queues a line without waiting, so a slow client cannot hold up a broadcast
+        if not self.writer.is_closing():
+            self.writer.write((line + "\n").encode())
+
+
+class GameServer:
+    def __init__(self, workers=None, tt_megabytes=4):
+        self.games = {}
+        self.next_id = 1
+        self.clients = set()
+        self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                        initializer=init_worker_table, initargs=(tt_megabytes,))
+        self.move_latency = Latencies()
+        self.engine_latency = Latencies()
+        self.finished = 0
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    async def handle_client(self, reader, writer):
+        client = Client(writer)
+        self.clients.add(client)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                tokens = line.decode(errors="replace").split()
+                if not tokens:
+                    continue
+                if tokens[0] == "quit":
+                    break
+                try:
+                    self.handle(client, tokens[0], tokens[1:])
+                except ValueError as error:
+                    client.send("error " + str(error))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.disconnect(client)
+            writer.close()
+
+    def handle(self, client, command, args):
+        # Runs one command, raising ValueError for bad input
+        if command == "create":
+            self.create(client, args)
+        elif command == "list":
+            client.send("games " + " ".join(str(game.id) for game in self.games.values()
+                                            if game.engine is None and None in game.players.values()))
+        elif command == "stats":
+            client.send("stats " + self.stats())
+        elif command in ("join", "watch", "move", "moves", "resign"):
+            if not args or not args[0].isdigit() or int(args[0]) not in self.games:
+                raise ValueError("no such game")
+            game = self.games[int(args[0])]
+            getattr(self, command)(client, game, args[1:])
+        else:
+            raise ValueError("unknown command " + command)
+
+    def create(self, client, args):
+        color = 'b' if "black" in args else 'w'
+        engine = None
+        depth = 0
+        if "engine" in args:
+            i = args.index("engine")
+            depth = int(args[i + 1]) if i + 1 < len(args) and args[i + 1].isdigit() else 2
+            depth = min(max(depth, 1), MAX_ENGINE_DEPTH)
+            engine = 'b' if color == 'w' else 'w'
+
+        game = Game(self.next_id, engine, depth)
+        self.next_id += 1
+        self.games[game.id] = game
+        game.players[color] = client
+        client.games.add(game)
+        client.send("created %d %s" % (game.id, "white" if color == 'w' else "black"))
+        if engine is not None:
+            self.start(game)
+
+    def join(self, client, game, args):
+        if game.engine is not None or None not in game.players.values():
+            raise ValueError("game is full")
+        color = 'w' if game.players['w'] is None else 'b'
+        game.players[color] = client
+        client.games.add(game)
+        client.send("joined %d %s" % (game.id, "white" if color == 'w' else "black"))
+        self.start(game)
+
+    def start(self, game):
+        for client in game.clients():
+            client.send("start %d %s" % (game.id, game.board.to_fen()))
+        self.engine_turn(game)
+
+    def watch(self, client, game, args):
+        game.spectators.add(client)
+        client.games.add(game)
+        client.send("watching %d %s" % (game.id, game.board.to_fen()))
+
+    def moves(self, client, game, args):
+        client.send("moves %d %s" % (game.id, " ".join(move.get_long_notation()
+                                                      for move in game.board.get_valid_moves())))
+
+    def move(self, client, game, args):
+        start = time.perf_counter()
+        if game.result is not None:
+            raise ValueError("game is over")
+        if not game.seated():
+            raise ValueError("waiting for an opponent")
+        if game.players[game.color_to_move()] is not client:
+            raise ValueError("not your move")
+        if not args:
+            raise ValueError("no move given")
+        self.play(game, game.board.parse_move(args[0]))
+        self.move_latency.add(time.perf_counter() - start)
+
+    def resign(self, client, game, args):
+        for color, player in game.players.items():
+            if player is client and game.result is None:
+                self.finish(game, "0-1" if color == 'w' else "1-0", "resignation")
+                return
+        raise ValueError("not playing this game")
+
+    def play(self, game, move):
+        # Makes a legal move, tells everyone in the game and checks for the end
+        board = game.board
+        board.make_move(move)
+        line = "moved %d %s %s" % (game.id, move.get_long_notation(), board.to_fen())
+        for client in game.clients():
+            client.send(line)
+
+        board.get_valid_moves()
+        if board.checkmate:
+            self.finish(game, "0-1" if board.white_to_move else "1-0", "checkmate")
+        elif board.stalemate:
+            self.finish(game, "1/2-1/2", "stalemate")
+        elif board.repetition_count() >= 3:
+            self.finish(game, "1/2-1/2", "repetition")
+        else:
+            self.engine_turn(game)
+
+    def engine_turn(self, game):
+        # Starts the engine's search in the worker pool when it is to move
+        if game.engine == game.color_to_move() and game.result is None:
+            asyncio.get_running_loop().create_task(self.engine_move(game))
+
+    async def engine_move(self, game):
+        board = game.board
+        ply = len(board.move_log)
+        start = time.perf_counter()
+        task = (board.encode(), board.encode_keys(), game.engine_depth)
+        move_id = await asyncio.get_running_loop().run_in_executor(self.pool, _engine_move, task)
+        self.engine_latency.add(time.perf_counter() - start)
+
+        # The game may have ended or moved on while the engine was thinking
+        if game.result is None and len(board.move_log) == ply and move_id is not None:
+            self.play(game, board.get_valid_move_ids()[move_id])
+
+    def finish(self, game, result, reason):
+        game.result = result
+        self.finished += 1
+        for client in game.clients():
+            client.send("over %d %s %s" % (game.id, result, reason))
+            client.games.discard(game)
+        del self.games[game.id]
+
+    def disconnect(self, client):
+        # A player leaving forfeits their games, spectators just stop watching
+        self.clients.discard(client)
+        for game in list(client.games):
+            game.spectators.discard(client)
+            for color, player in game.players.items():
+                if player is client:
+                    game.players[color] = None
+                    if game.result is None:
+                        self.finish(game, "0-1" if color == 'w' else "1-0", "disconnect")
+
+    def stats(self):
+        # Games, memory per game and latencies, as one line
+        sizes = [deep_size(game.board) for game in self.games.values()]
+        memory = "memory mean %.1fKB max %.1fKB" % (sum(sizes) / len(sizes) / 1024, max(sizes) / 1024) \
+            if sizes else "memory mean 0KB max 0KB"
+        return "games %d finished %d clients %d %s move %s engine %s" % (
+            len(self.games), self.finished, len(self.clients), memory,
+            self.move_latency.summary(), self.engine_latency.summary())
+
+
+async def serve(host, port, workers):
+    server = GameServer(workers)
+    listener = await asyncio.start_server(server.handle_client, host, port)
+    print("listening on %s:%d" % (host, port), flush=True)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+
+async def bench_client(host, port, color, game_id, max_plies, rng):
+    # A local client playing random legal moves for one side of a game.
+    # color is 'w' (creates the game and sets game_id) or 'b' (joins it)
+    reader, writer = await asyncio.open_connection(host, port)
+
+    def send(line):
+        writer.write((line + "\n").encode())
+
+    if color == 'w':
+        send("create white")
+    else:
+        send("join %d" % await game_id)
+
+    plies = 0
+    async for line in reader:
+        words = line.decode().split()
+        if words[0] == "created":
+            game_id.set_result(int(words[1]))
+        elif words[0] == "over":
+            break
+        elif words[0] in ("start", "moved") and words[-3] == color:
+            # The FEN ends with the side to move and the two move counters
+            if plies >= max_plies:
+                send("resign " + words[1])
+            else:
+                send("moves " + words[1])
+        elif words[0] == "moves":
+            send("move %s %s" % (words[1], rng.choice(words[2:])))
+            plies += 1
+        await writer.drain()
+    send("quit")
+    writer.close()
+
+
+async def bench(games, max_plies, workers):
+    # Plays random games between local clients, then prints the server stats
+    server = GameServer(workers)
+    listener = await asyncio.start_server(server.handle_client, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    rng = random.Random(0)
+    start = time.perf_counter()
+
+    clients = []
+    for _ in range(games):
+        game_id = asyncio.get_running_loop().create_future()
+        clients.append(bench_client("127.0.0.1", port, 'w', game_id, max_plies, rng))
+        clients.append(bench_client("127.0.0.1", port, 'b', game_id, max_plies, rng))
+
+    async def report():
+        # Stats while the games are running
+        while True:
+            await asyncio.sleep(5)
+            print("running: " + server.stats(), flush=True)
+
+    reporter = asyncio.get_running_loop().create_task(report())
+    await asyncio.gather(*clients)
+    reporter.cancel()
+    elapsed = time.perf_counter() - start
+    print("after:  " + server.stats())
+    print("%d games in %.1fs, %.0f moves/s" % (games, elapsed, server.move_latency.count / elapsed))
+    listener.close()
+    server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="engine processes (default: all cores)")
+    parser.add_argument("--bench", type=int, default=0, metavar="GAMES",
+                        help="play GAMES random games between local clients and report")
+    parser.add_argument("--plies", type=int, default=100, help="plies per benchmark game")
+    args = parser.parse_args()
+    enable_from_environment()
+
+    if args.bench:
+        asyncio.run(bench(args.bench, args.plies, args.workers))
+    else:
+        asyncio.run(serve(args.host, args.port, args.workers))
+
+
+if __name__ == "__main__":
+    main()
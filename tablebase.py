@@ -0,0 +1,406 @@
+"""
+Endgame tablebases: win/draw/loss and distance to mate for every position
+of a few-piece ending, worked out by retrograde analysis
+
+A table covers one set of material without pawns, named like "KRvKN" (the
+white pieces, "v", the black pieces). Tables for the same material with the
+colors swapped are shared. The rules are the same for both colors and for
+every rotation of the board around the rings, so positions are stored with
+the white king turned to sector 0. A table holds
+
+    2 sides to move * 4 annuli of the white king * 64 ** (pieces - 1)
+
+entries: 32K for three pieces, 2M for four and 134M for five.
+
+Generation needs NumPy. Every position is given a value, then positions are
+resolved in rounds: checkmates first, then wins one ply deeper, then losses
+one ply deeper, and so on. Moves come from the tables in tables.py, so
+the ring wraparound and the ban on the null move match Board. Captures are
+looked up in the smaller tables, which are generated first.
+
+    python3 tablebase.py KQvK KRvK KRvKN --output tablebases
+
+A table file is a 32-byte header followed by one little-endian int16 per
+position. The values are:
+- 0 for a draw;
+- d for a win with mate in d plies;
+- -(d + 1) for a loss, being mated in d plies;
+- INVALID for positions that cannot occur.
+
+Tablebases probes the files through mmap without reading them in, so a
+lookup costs the same for any table size and needs no NumPy.
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import time
+
+from constants import ANNULI, SECTORS
+from bitboard import SQUARES, iter_squares
+from tables import KING_DIRECTIONS, KNIGHT_JUMPS, BISHOP_DIRECTIONS, ROOK_DIRECTIONS, step
+
+# Pieces in the order they are listed in a name and stored in an index
+PIECE_ORDER = "KQRBN"
+PIECE_STRENGTH = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3}
+MAX_PIECES = 5
+
+INVALID = -32768
+DRAW, WIN, LOSS = 0, 1, -1
+
+MAGIC = b"CCTB"
+VERSION = 1
+HEADER = struct.Struct("<4sBB2x16sQ")
+EXTENSION = ".cctb"
+
+# (directions, most steps along each) of every piece. Around a ring a slider
+# can go 15 steps, one short of the null move back to its own square
+MOVES = {
+    'K': [(d, 1) for d in KING_DIRECTIONS],
+    'N': [(d, 1) for d in KNIGHT_JUMPS],
+    'B': [(d, ANNULI - 1) for d in BISHOP_DIRECTIONS],
+    'R': [(d, ANNULI - 1 if d[0] else SECTORS - 1) for d in ROOK_DIRECTIONS],
+}
+MOVES['Q'] = MOVES['B'] + MOVES['R']
+
+
+def parse_name(name):
+    # Splits "KRvKN" into ("KR", "KN"), checking the pieces
+    sides = name.split('v')
+    if len(sides) != 2 or any(not side or side[0] != 'K' or side.count('K') != 1 or
+                              any(kind not in PIECE_ORDER for kind in side) for side in sides):
+        raise ValueError("Not a pawnless ending: " + name)
+    white, black = (''.join(sorted(side, key=PIECE_ORDER.index)) for side in sides)
+    if len(white) + len(black) > MAX_PIECES:
+        raise ValueError("Too many pieces: " + name)
+    return white, black
+
+
+def canonical(white, black):
+    # The name of the table holding the material, and whether the colors
+    # have to be swapped to look it up: the stronger side plays white
+    def strength(side):
+        return sum(PIECE_STRENGTH[kind] for kind in side), len(side), side
+
+    if strength(black) > strength(white):
+        return black + 'v' + white, True
+    return white + 'v' + black, False
+
+
+def table_size(pieces):
+    return 2 * ANNULI * SQUARES ** (pieces - 1)
+
+
+def position_index(squares, white_to_move):
+    # Index of a position given the squares of its pieces in table order,
+    # white king first, with the board turned so that king is on sector 0
+    turn = squares[0] % SECTORS
+    index = 0 if white_to_move else 1
+    index = index * ANNULI + squares[0] // SECTORS
+    for sq in squares[1:]:
+        index = index * SQUARES + sq - sq % SECTORS + (sq - turn) % SECTORS
+    return index
+
+
+class Tablebases:
+    # Looks up positions in the table files of a directory through mmap
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self.max_pieces = 0
+        for filename in os.listdir(directory):
+            if filename.endswith(EXTENSION):
+                name = filename[:-len(EXTENSION)]
+                self.files[name] = None
+                self.max_pieces = max(self.max_pieces, len(name) - 1)
+
+    def open(self, name):
+        # Maps a table file the first time it is probed
+        table = self.files.get(name)
+        if table is None:
+            with open(os.path.join(self.directory, name + EXTENSION), "rb") as file:
+                table = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, _, _, count = HEADER.unpack_from(table)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not a tablebase file: " + name)
+            self.files[name] = table
+        return table
+
+    def probe(self, board):
+        # Gets (WIN, DRAW or LOSS for the side to move, plies to mate or
+        # None for a draw) for the position, or None if there is no table
+        pieces = board.position.pieces
+        if pieces['wp'] or pieces['bp']:
+            return None
+        white = ''.join(kind * bin(pieces['w' + kind]).count('1') for kind in PIECE_ORDER)
+        black = ''.join(kind * bin(pieces['b' + kind]).count('1') for kind in PIECE_ORDER)
+        name, swap = canonical(white, black)
+        if name not in self.files or not pieces['wK'] or not pieces['bK']:
+            return None
+
+        first, second = ('b', 'w') if swap else ('w', 'b')
+        squares = [sq for color in (first, second) for kind in PIECE_ORDER
+                   for sq in iter_squares(pieces[color + kind])]
+        index = position_index(squares, board.white_to_move != swap)
+        value = struct.unpack_from("<h", self.open(name), HEADER.size + 2 * index)[0]
+        return decode_value(value)
+
+
+def decode_value(value):
+    # (result, plies to mate) of a stored value, see the module docstring
+    if value == INVALID:
+        return None
+    if value > 0:
+        return WIN, value
+    if value < 0:
+        return LOSS, -value - 1
+    return DRAW, None
+
+
+class Generator:
+    # Builds tables with NumPy, keeping the finished ones for captures
+    def __init__(self, directory, log=print, chunk_size=1 << 20):
+        import numpy as np
+
+        self.np = np
+        self.directory = directory
+        self.log = log
+        self.chunk_size = chunk_size
+        self.tables = {}
+
+        # STEPS[direction][sq] is the square one step away, SQUARES when the
+        # step leaves the board. SQUARES steps to itself
+        self.steps = {}
+        for moves in MOVES.values():
+            for direction, _ in moves:
+                targets = [step(sq, direction) for sq in range(SQUARES)]
+                self.steps[direction] = np.array([SQUARES if t is None else t for t in targets] + [SQUARES],
+                                                 dtype=np.int16)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + EXTENSION)
+
+    def load(self, name):
+        # Values of a finished table, generating it and its smaller tables first
+        if name in self.tables:
+            return self.tables[name]
+        if os.path.exists(self.path(name)):
+            self.tables[name] = self.np.memmap(self.path(name), dtype="<i2", mode='r', offset=HEADER.size)
+        else:
+            self.tables[name] = self.generate(name)
+        return self.tables[name]
+
+    def generate(self, name):
+        np = self.np
+        white, black = parse_name(name)
+        pieces = [('w', kind) for kind in white] + [('b', kind) for kind in black]
+        n = len(pieces)
+        size = table_size(n)
+        half = size // 2
+
+        # Every capture leads to a smaller table, which has to be finished first
+        longest = 0
+        for j in range(n):
+            if pieces[j][1] != 'K':
+                rest = [piece for k, piece in enumerate(pieces) if k != j]
+                sub, _ = canonical(''.join(k for c, k in rest if c == 'w'), ''.join(k for c, k in rest if c == 'b'))
+                values = self.load(sub)
+                resolved = values[(values != INVALID) & (values != 0)]
+                if len(resolved):
+                    longest = max(longest, int(np.abs(resolved).max()))
+
+        start = time.perf_counter()
+        self.log("generating %s: %d positions" % (name, size))
+        values = np.zeros(size, dtype=np.int16)
+        pending = np.ones(size, dtype=bool)
+
+        # Positions with two pieces on a square, or where the side that just
+        # moved left its king in check, cannot occur
+        for begin in range(0, size, self.chunk_size):
+            index = np.arange(begin, min(begin + self.chunk_size, size))
+            squares, stm = self.decode(index, n)
+            invalid = self.collisions(squares)
+            for side in (0, 1):
+                rows = (stm == side) & ~invalid
+                movers = [i for i, (color, _) in enumerate(pieces) if color == 'wb'[side]]
+                king = [i for i, piece in enumerate(pieces) if piece == ('bw'[side], 'K')][0]
+                attacked = np.zeros(rows.sum(), dtype=bool)
+                for i, target, possible, _ in self.moves([sq[rows] for sq in squares], pieces, movers):
+                    attacked |= possible & (target == squares[king][rows])
+                invalid[np.nonzero(rows)[0][attacked]] = True
+            values[index[invalid]] = INVALID
+            pending[index[invalid]] = False
+
+        # Rounds: checkmates and stalemates in round 0, then wins at odd and
+        # losses at even distances to mate
+        depth = 0
+        quiet = 0
+        while quiet < 2 or depth <= longest + 1:
+            changed = 0
+            for begin in range(0, size, self.chunk_size):
+                index = np.arange(begin, min(begin + self.chunk_size, size))
+                index = index[pending[index]]
+                if len(index):
+                    changed += self.resolve(values, pending, index, pieces, depth, half)
+            quiet = 0 if changed else quiet + 1
+            depth += 1
+            if depth > 32000:
+                break
+
+        counts = np.bincount(np.sign(values[values != INVALID]) + 1, minlength=3)
+        self.log("%s: %d wins, %d draws, %d losses, longest mate %d plies, %.1fs" % (
+            name, counts[2], counts[1], counts[0], depth - quiet - 1, time.perf_counter() - start))
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(name), "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, n, name.encode("ascii"), size))
+            values.astype("<i2").tofile(file)
+        return values
+
+    def decode(self, index, n):
+        # Squares of every piece, and the side to move (0 white, 1 black), of
+        # an array of indexes
+        np = self.np
+        rest = index.copy()
+        squares = []
+        for _ in range(n - 1):
+            squares.append((rest % SQUARES).astype(np.int16))
+            rest //= SQUARES
+        squares.append((rest % ANNULI * SECTORS).astype(np.int16))
+        stm = (rest // ANNULI).astype(np.int8)
+        return squares[::-1], stm
+
+    def collisions(self, squares):
+        np = self.np
+        clash = np.zeros(len(squares[0]), dtype=bool)
+        for i in range(len(squares)):
+            for j in range(i + 1, len(squares)):
+                clash |= squares[i] == squares[j]
+        return clash
+
+    def moves(self, squares, pieces, movers):
+        # Yields (piece, target squares, whether the move is possible, index
+        # of the captured piece or -1) for every step along every direction
+        # of the moving pieces, over arrays of positions. A piece stops at the
+        # first square that is taken and can capture an enemy piece there
+        np = self.np
+        for i in movers:
+            color, kind = pieces[i]
+            own = [j for j, piece in enumerate(pieces) if piece[0] == color and j != i]
+            enemy = [j for j, piece in enumerate(pieces) if piece[0] != color]
+            for direction, steps in MOVES[kind]:
+                table = self.steps[direction]
+                target = squares[i]
+                alive = np.ones(len(target), dtype=bool)
+                for _ in range(steps):
+                    target = table[target]
+                    alive &= target != SQUARES
+                    for j in own:
+                        alive &= squares[j] != target
+                    captured = np.full(len(target), -1, dtype=np.int8)
+                    for j in enemy:
+                        captured[squares[j] == target] = j
+                    yield i, target, alive.copy(), captured
+                    alive &= captured < 0
+                    if not alive.any():
+                        break
+
+    def child_values(self, squares, stm, pieces, i, target, captured):
+        # Values of the positions after piece i moves to target, capturing
+        # the piece given by captured (-1 for none), for the new side to move
+        np = self.np
+        values = np.full(len(target), INVALID, dtype=np.int32)
+        moved = list(squares)
+        moved[i] = target
+
+        for j in sorted(set(captured.tolist())):
+            rows = captured == j
+            rest = [k for k in range(len(pieces)) if k != j]
+            if j < 0:
+                name, swap = canonical(''.join(k for c, k in pieces if c == 'w'),
+                                       ''.join(k for c, k in pieces if c == 'b'))
+            else:
+                name, swap = canonical(''.join(pieces[k][1] for k in rest if pieces[k][0] == 'w'),
+                                       ''.join(pieces[k][1] for k in rest if pieces[k][0] == 'b'))
+            order = [k for k in rest if pieces[k][0] == ('b' if swap else 'w')] + \
+                    [k for k in rest if pieces[k][0] == ('w' if swap else 'b')]
+            child = [moved[k][rows].astype(np.int64) for k in order]
+
+            # Turn the board so the white king of the child table is on sector 0
+            turn = child[0] % SECTORS
+            index = 1 - stm[rows].astype(np.int64) if not swap else stm[rows].astype(np.int64)
+            index = index * ANNULI + child[0] // SECTORS
+            for sq in child[1:]:
+                index = index * SQUARES + sq - sq % SECTORS + (sq - turn) % SECTORS
+            values[rows] = self.tables[name][index] if name in self.tables else self.current[index]
+        return values
+
+    def resolve(self, values, pending, index, pieces, depth, half):
+        # One round over the pending positions of a chunk. Returns how many
+        # were resolved
+        np = self.np
+        self.current = values
+        squares, stm = self.decode(index, len(pieces))
+        resolved = 0
+
+        for side in (0, 1):
+            rows = stm == side
+            if not rows.any():
+                continue
+            rows_index = index[rows]
+            rows_squares = [sq[rows] for sq in squares]
+            rows_stm = stm[rows]
+            movers = [i for i, (color, _) in enumerate(pieces) if color == 'wb'[side]]
+
+            has_move = np.zeros(len(rows_index), dtype=bool)
+            wins = np.zeros(len(rows_index), dtype=bool)
+            all_won = np.ones(len(rows_index), dtype=bool)
+            for i, target, possible, captured in self.moves(rows_squares, pieces, movers):
+                if not possible.any():
+                    continue
+                child = np.full(len(rows_index), INVALID, dtype=np.int32)
+                child[possible] = self.child_values([sq[possible] for sq in rows_squares], rows_stm[possible],
+                                                    pieces, i, target[possible], captured[possible])
+                legal = child != INVALID
+                has_move |= legal
+                # A child lost in depth - 1 plies is a win in depth plies
+                wins |= legal & (child == -depth)
+                # A loss needs every child to be a win found before this round
+                all_won &= ~legal | ((child > 0) & (child <= depth - 1))
+
+            if depth == 0:
+                # No legal move: checkmate when in check, otherwise stalemate
+                flipped = rows_index + np.where(rows_stm == 0, half, -half)
+                in_check = values[flipped] == INVALID
+                mated = ~has_move & in_check
+                stalemate = ~has_move & ~in_check
+                values[rows_index[mated]] = -1
+                pending[rows_index[mated | stalemate]] = False
+                resolved += int(mated.sum())
+            elif depth % 2:
+                values[rows_index[wins]] = depth
+                pending[rows_index[wins]] = False
+                resolved += int(wins.sum())
+            else:
+                lost = has_move & all_won
+                values[rows_index[lost]] = -depth - 1
+                pending[rows_index[lost]] = False
+                resolved += int(lost.sum())
+        return resolved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate endgame tablebases")
+    parser.add_argument("names", nargs="+", help="endings such as KQvK or KRvKN")
+    parser.add_argument("--output", default="tablebases", help="directory for the table files")
+    args = parser.parse_args()
+
+    generator = Generator(args.output)
+    for name in args.names:
+        white, black = parse_name(name)
+        generator.load(canonical(white, black)[0])
+
+
+if __name__ == "__main__":
+    main()
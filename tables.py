@@ -0,0 +1,120 @@
+"""
+Move tables for the circular board, built once at import
+
+Every table is indexed by square (annulus*16 + sector, as in bitboard.py).
+Sector arithmetic wraps around the ring here, so move generation only has
+to walk the tables.
+"""
+
+from constants import ANNULI, SECTORS
+from bitboard import SQUARES, BIT, square, sector_mask
+
+# (annulus, sector) of every square
+COORDS = [divmod(sq, SECTORS) for sq in range(SQUARES)]
+
+# (annulus step, sector step) of each direction a piece can move in
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+KING_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KNIGHT_JUMPS = [(2, 1), (2, -1), (-2, 1), (-2, -1),
+                (1, 2), (1, -2), (-1, 2), (-1, -2)]
+
+
+def step(sq, direction):
+    # Square reached from sq by one step in direction, or None when the step
+    # leaves the board through the inner or outer ring
+    a, sect = COORDS[sq]
+    new_a = a + direction[0]
+    if new_a < 0 or new_a >= ANNULI:
+        return None
+    return square(new_a, (sect + direction[1]) % SECTORS)
+
+
+def build_ray(sq, direction):
+    # Squares from sq outwards in one direction. Around a ring this is a full
+    # lap that stops before the null move back to the starting square
+    ray = []
+    current = step(sq, direction)
+    while current is not None and current != sq:
+        ray.append(current)
+        current = step(current, direction)
+    return tuple(ray)
+
+
+def to_mask(squares):
+    mask = 0
+    for sq in squares:
+        mask |= BIT[sq]
+    return mask
+
+
+# NEIGHBORS[sq][direction] is the adjacent square in each of the 8 king directions
+NEIGHBORS = [{d: step(sq, d) for d in KING_DIRECTIONS} for sq in range(SQUARES)]
+
+KING_STEPS = [tuple(t for t in NEIGHBORS[sq].values() if t is not None)
+              for sq in range(SQUARES)]
+KNIGHT_JUMP_SQUARES = [tuple(t for t in (step(sq, d) for d in KNIGHT_JUMPS) if t is not None)
+                       for sq in range(SQUARES)]
+
+KING_MASKS = [to_mask(squares) for squares in KING_STEPS]
+KNIGHT_MASKS = [to_mask(squares) for squares in KNIGHT_JUMP_SQUARES]
+
+ROOK_RAYS = [tuple(r for r in (build_ray(sq, d) for d in ROOK_DIRECTIONS) if r)
+             for sq in range(SQUARES)]
+BISHOP_RAYS = [tuple(r for r in (build_ray(sq, d) for d in BISHOP_DIRECTIONS) if r)
+               for sq in range(SQUARES)]
+QUEEN_RAYS = [BISHOP_RAYS[sq] + ROOK_RAYS[sq] for sq in range(SQUARES)]
+
+# Pawns on the right half (sectors 5-10) and the left half (sectors 13-2) of the
+# board move in opposite directions around the rings. For each color this lists
+# (squares of that half, direction of travel, starting sector of the pawns)
+RIGHT_HALF = sector_mask(range(5, 11))
+LEFT_HALF = sector_mask([13, 14, 15, 0, 1, 2])
+
+PAWN_DIRECTIONS = {
+    'w': [(RIGHT_HALF, -1, sector_mask([10])), (LEFT_HALF, 1, sector_mask([13]))],
+    'b': [(RIGHT_HALF, 1, sector_mask([5])), (LEFT_HALF, -1, sector_mask([2]))]
+}
+
+
+def build_pawn_attacks(color):
+    # Squares attacked by a pawn of the given color standing on each square
+    attacks = [0] * SQUARES
+    for half, direction, _ in PAWN_DIRECTIONS[color]:
+        for sq in range(SQUARES):
+            if half & BIT[sq]:
+                attacks[sq] = to_mask(t for t in (step(sq, (-1, direction)), step(sq, (1, direction)))
+                                      if t is not None)
+    return attacks
+
+
+PAWN_ATTACK_MASKS = {color: build_pawn_attacks(color) for color in ('w', 'b')}
+
+
+def build_pawn_pushes(color):
+    # For each square: the square a pawn of the given color standing there
+    # moves to, and the square of its two-step move from the starting sector
+    # (None where there is no such move). Also returns the mask of squares
+    # where the color's pawns promote: those a pawn steps onto out of its half
+    pushes = [None] * SQUARES
+    doubles = [None] * SQUARES
+    promotions = 0
+    for half, direction, start in PAWN_DIRECTIONS[color]:
+        for sq in range(SQUARES):
+            if half & BIT[sq]:
+                pushes[sq] = step(sq, (0, direction))
+                if start & BIT[sq]:
+                    doubles[sq] = step(pushes[sq], (0, direction))
+                if not half & BIT[pushes[sq]]:
+                    promotions |= BIT[pushes[sq]]
+    return pushes, doubles, promotions
+
+
+# PAWN_PUSHES[color] is (pushes, double pushes, promotion mask) from build_pawn_pushes
+PAWN_PUSHES = {color: build_pawn_pushes(color) for color in ('w', 'b')}
+
+# PAWN_ATTACKER_MASKS[color][sq] holds the squares from which a pawn of that
+# color attacks sq
+PAWN_ATTACKER_MASKS = {color: [to_mask(s for s in range(SQUARES) if PAWN_ATTACK_MASKS[color][s] & BIT[sq])
+                               for sq in range(SQUARES)]
+                       for color in ('w', 'b')}
@@ -0,0 +1,49 @@
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from book import HEADER, MAGIC, VERSION
+from engine import Engine
+
+
+class BadInputTest(unittest.TestCase):
+    # Malformed commands are reported and the engine keeps reading commands
+    def run_commands(self, lines):
+        output = io.StringIO()
+        engine = Engine(output)
+        for line in lines:
+            self.assertTrue(engine.handle(line))
+        engine.wait()
+        return output.getvalue().splitlines()
+
+    def test_bad_go_and_setoption(self):
+        lines = self.run_commands(["go depth", "go depth x", "go movetime", "setoption name Hash value x",
+                                   "setoption name Hash value", "isready"])
+        self.assertEqual(lines, ["info string invalid go depth", "info string invalid go depth x",
+                                 "info string invalid go movetime", "info string invalid Hash value x",
+                                 "info string invalid Hash value", "readyok"])
+
+    def test_search_after_bad_input(self):
+        lines = self.run_commands(["go nodes -", "go depth 1"])
+        self.assertEqual(lines[0], "info string invalid go nodes -")
+        self.assertTrue(lines[-1].startswith("bestmove "))
+
+    def test_truncated_book(self):
+        # Shorter than the header, and a header promising entries that are missing
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ("short.bin", "entries.bin")]
+            with open(paths[0], "wb") as file:
+                file.write(b"CCBK")
+            with open(paths[1], "wb") as file:
+                file.write(HEADER.pack(MAGIC, VERSION, 10))
+            lines = self.run_commands(["setoption name BookPath value " + path for path in paths] + ["isready"])
+        self.assertEqual(lines, ["info string Not an opening book: " + paths[0],
+                                 "info string Truncated opening book: " + paths[1], "readyok"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,23 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from board import Board, START_FEN, parse_fen
+
+
+class FenTest(unittest.TestCase):
+    def test_round_trip(self):
+        for fen in (START_FEN, "16/16/16/16 b 3 20", "11k4/1p5n6p1/R5P9/K8P6 w 0 1"):
+            self.assertEqual(Board.from_fen(fen).to_fen(), fen)
+
+    def test_bad_empty_runs(self):
+        # Zero and zero-padded runs, and ranks that do not cover 16 sectors
+        for rank in ("0P15", "P0p14", "016", "010P5", "17", "15", "8P8", "P16", "16P"):
+            with self.assertRaises(ValueError):
+                parse_fen("/".join([rank, "16", "16", "16"]) + " w")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from board import Board
+
+
+class DuplicateMoveTest(unittest.TestCase):
+    # Sliders on a ring reach their squares going either way round, but
+    # every destination is generated once
+    def assert_distinct(self, board):
+        moves = board.get_all_moves()
+        self.assertEqual(len(moves), len({move.move_id for move in moves}))
+        return moves
+
+    def test_open_ring(self):
+        self.assertEqual(len(self.assert_distinct(Board.from_fen("16/16/R15/K9k5 w 0 1"))), 21)
+
+    def test_single_blocker(self):
+        moves = self.assert_distinct(Board.from_fen("16/16/R7n7/K9k5 w 0 1"))
+        self.assertEqual(len(moves), 21)
+        self.assertEqual(sum(1 for move in moves if move.piece_captured != "--"), 1)
+
+    def test_random_games(self):
+        rng = random.Random(7)
+        for _ in range(20):
+            board = Board()
+            for _ in range(120):
+                moves = self.assert_distinct(board)
+                if not moves:
+                    break
+                board.make_move(rng.choice(moves))
+
+
+if __name__ == "__main__":
+    unittest.main()
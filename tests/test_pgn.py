@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pgn import read_games
+
+RECORDS = ('[White "a"]\n\n1. b1c1 j1k1 1-0\n\n'
+           '[White "b"]\n\n1. b1c1 {no result}\n'
+           '[White "c"]\n\n1. b1c1 j1k1 2. c1d1 0-1\n')
+
+
+class OffsetTest(unittest.TestCase):
+    # Reading from the offset given for a game yields the games after it
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "games.pgn")
+            with open(path, "w") as file:
+                file.write(RECORDS)
+            pairs = list(read_games(path, offsets=True))
+            self.assertEqual([game.headers["White"] for game, _ in pairs], ["a", "b", "c"])
+            self.assertEqual(pairs[1][0].result, "*")
+            for i, (_, offset) in enumerate(pairs):
+                self.assertEqual([game.headers["White"] for game in read_games(path, offset)],
+                                 [game.headers["White"] for game, _ in pairs[i + 1:]])
+            self.assertEqual(pairs[-1][1], os.path.getsize(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+"""
+Zobrist keys for positions and a fixed-size transposition table
+
+A position's key is the XOR of one random 64-bit number per (piece, square)
+on the board, plus SIDE_KEY when black is to move, so make_move and
+undo_move can update it with a few XORs.
+"""
+
+import random
+from array import array
+from functools import lru_cache
+
+from constants import ANNULI, SECTORS
+from bitboard import SQUARES, PIECES
+
+# Fixed seed, so keys (and anything stored under them) match between runs
+_rng = random.Random(20240101)
+
+PIECE_KEYS = {piece: [_rng.getrandbits(64) for _ in range(SQUARES)] for piece in PIECES}
+SIDE_KEY = _rng.getrandbits(64)
+
+
+def compute_key(board, white_to_move):
+    # Computes the key of a 4x16 board from scratch
+    key = 0 if white_to_move else SIDE_KEY
+    for a in range(ANNULI):
+        key ^= row_key(a, tuple(board[a]))
+    return key
+
+
+@lru_cache(maxsize=65536)
+def row_key(a, row):
+    # XOR of the keys of the pieces on one annulus, cached like row_bitboards
+    key = 0
+    for sect, piece in enumerate(row):
+        if piece != "--":
+            key ^= PIECE_KEYS[piece][a * SECTORS + sect]
+    return key
+
+
+# Bound stored with a score: exact, or a lower/upper bound from a cutoff
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# Layout of the 64-bit data word stored next to each key
+_MOVE_BITS = 16
+_DEPTH_SHIFT = 16
+_FLAG_SHIFT = 24
+_AGE_SHIFT = 26
+_SCORE_SHIFT = 32
+_SCORE_OFFSET = 1 << 31
+
+ENTRY_BYTES = 16
+
+
+def table_words(megabytes):
+    # 64-bit words taken by the keys and data of a table of that budget
+    entries = max(2, megabytes * 1024 * 1024 // ENTRY_BYTES)
+    return 2 * (2 << (entries // 2).bit_length() - 1)
+
+
+class TranspositionTable:
+    # Stores search results by Zobrist key in two flat arrays of 64-bit words,
+    # so the memory used is fixed by the budget given at creation.
+    # Entries live in buckets of two: the first slot keeps the deepest result
+    # of the current search, the second is always replaced.
+    # A slot holds the key XORed with its data word, so an entry torn by two
+    # processes writing the same slot of a shared table no longer matches
+    def __init__(self, megabytes=16, buffer=None):
+        self.size = table_words(megabytes) // 2
+        self.mask = self.size // 2 - 1
+        if buffer is None:
+            self.keys = array('Q', [0]) * self.size
+            self.data = array('Q', [0]) * self.size
+        else:
+            # Both arrays in a buffer of table_words(megabytes) words, such as
+            # a multiprocessing.RawArray shared between processes
+            words = memoryview(buffer).cast('B').cast('Q')
+            self.keys = words[:self.size]
+            self.data = words[self.size:2 * self.size]
+        self.age = 0
+
+    def new_search(self):
+        # Ages the stored entries so they are replaced first
+        self.age = (self.age + 1) & 63
+
+    def clear(self):
+        # Emptied in place, which keeps a shared table shared
+        self.keys[:] = array('Q', [0]) * self.size
+        self.data[:] = array('Q', [0]) * self.size
+        self.age = 0
+
+    def probe(self, key):
+        # Gets (depth, flag, score, move_id) stored for the key, or None
+        index = (key & self.mask) << 1
+        for slot in (index, index + 1):
+            data = self.data[slot]
+            if self.keys[slot] ^ data == key:
+                return ((data >> _DEPTH_SHIFT) & 0xFF,
+                        (data >> _FLAG_SHIFT) & 0x3,
+                        (data >> _SCORE_SHIFT) - _SCORE_OFFSET,
+                        data & ((1 << _MOVE_BITS) - 1))
+        return None
+
+    def store(self, key, depth, flag, score, move_id=0):
+        # Stores a result, in the depth-preferred slot if it is free, holds the
+        # same position, is left over from an earlier search or is shallower
+        index = (key & self.mask) << 1
+        data = (move_id | depth << _DEPTH_SHIFT | flag << _FLAG_SHIFT |
+                self.age << _AGE_SHIFT | (score + _SCORE_OFFSET) << _SCORE_SHIFT)
+
+        stored = self.data[index]
+        same = self.keys[index] ^ stored == key
+        if same or not stored or \
+                (stored >> _AGE_SHIFT) & 63 != self.age or (stored >> _DEPTH_SHIFT) & 0xFF <= depth:
+            if stored and not same:
+                # The displaced entry still gets a chance in the other slot
+                self.keys[index + 1] = self.keys[index]
+                self.data[index + 1] = stored
+            self.keys[index] = key ^ data
+            self.data[index] = data
+        else:
+            self.keys[index + 1] = key ^ data
+            self.data[index + 1] = data
+
+    def hashfull(self):
+        # Permille of the first 1000 slots used in the current search
+        sample = min(1000, self.size)
+        used = sum(1 for slot in range(sample)
+                   if self.data[slot] and (self.data[slot] >> _AGE_SHIFT) & 63 == self.age)
+        return used * 1000 // sample
+
+
+# Transposition table of a pool worker process, set up by init_worker_table
+_worker_table = None
+
+
+def init_worker_table(megabytes, buffer=None):
+    # Pool initializer: gives each worker process a table kept between its
+    # tasks, its own or one over a shared buffer (see TranspositionTable)
+    global _worker_table
+    _worker_table = TranspositionTable(megabytes, buffer)
+
+
+def worker_table():
+    # The table set up by init_worker_table, or None outside a pool worker
+    return _worker_table